@@ -0,0 +1,432 @@
+# app/catalog.py
+"""
+Catalog dạng cột (NumPy) dùng chung trong một process cho truy vấn faceted:
+khoảng giá, còn hàng, thể loại, tác giả.
+
+- price/stock/id là mảng NumPy; author/category được dictionary-encode (mã int32 + bảng tên).
+- Title lưu thành một blob UTF-8 + mảng offset (không giữ 1 triệu đối tượng str); tra title
+  chính xác (không dấu) qua mảng hash đã sắp xếp + searchsorted.
+- find_exact() / find_*_in() phục vụ tra cứu của chat (app.chat_engine) mà không dựng list[dict]
+  cả catalog: câu chat chỉ có vài chục cụm từ, mỗi cụm là một lần tra hash/dict.
+- get_catalog() trả về bản dựng sẵn của process. Mỗi CATALOG_CHECK_SECONDS đọc phần mới của
+  book_changes (trigger ghi khi books đổi, ở bất kỳ process nào): chỉ đổi price/stock -> vá tại
+  chỗ; thêm/xoá sách hoặc đổi title/author/category -> dựng lại. Không đổi gì -> không đọc books.
+  apply_stock_delta() sửa tồn kho tại chỗ ngay sau khi đặt hàng trong process hiện tại.
+
+Benchmark 1 triệu sách tổng hợp: python -m app.catalog
+"""
+import threading
+import time
+import zlib
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from sqlalchemy import select, func, delete
+
+from .db import get_db_session
+from .models import Book, BookChange
+from .textnorm import norm_key, norm_keys
+
+CATALOG_CHECK_SECONDS = 1.0
+# Nhiều thay đổi hơn mức này trong một lần kiểm tra -> dựng lại thay vì vá từng dòng
+MAX_PATCH_ROWS = 5_000
+CHANGE_LOG_KEEP = 100_000
+CHANGE_LOG_PRUNE_SECONDS = 60.0
+# Cụm từ dài nhất (số từ) được thử khi tìm title/tác giả/thể loại trong câu chat
+MAX_PHRASE_WORDS = 12
+_BUILD_CHUNK = 10_000
+
+
+def phrase_key(value: Optional[str]) -> str:
+    """norm_key + gộp khoảng trắng: khoá so khớp title/author/category theo cụm từ."""
+    return " ".join(norm_key(value).split())
+
+
+def _phrases(text: str, max_words: int) -> Iterator[str]:
+    """Các cụm từ liên tiếp của `text` (đã chuẩn hoá), dài trước."""
+    words = text.split()
+    for n in range(min(max_words, len(words)), 0, -1):
+        for i in range(len(words) - n + 1):
+            yield " ".join(words[i:i + n])
+
+
+class _Dictionary:
+    """Dictionary encoding: khoá chuẩn hoá (bỏ dấu, lower) -> mã int; giữ tên hiển thị đầu tiên."""
+
+    def __init__(self):
+        self.names: list[str] = []
+        self.index: dict[str, int] = {}
+        self.max_words = 0
+
+    def encode(self, value: str) -> int:
+        key = phrase_key(value)
+        code = self.index.get(key)
+        if code is None:
+            code = len(self.names)
+            self.index[key] = code
+            self.names.append(value)
+            self.max_words = max(self.max_words, len(key.split()))
+        return code
+
+    def find_in(self, text: str) -> Optional[int]:
+        """Mã của tên dài nhất xuất hiện nguyên cụm trong `text` (đã chuẩn hoá)."""
+        for phrase in _phrases(text, min(self.max_words, MAX_PHRASE_WORDS)):
+            code = self.index.get(phrase)
+            if code is not None:
+                return code
+        return None
+
+    def lookup(self, value: str) -> list[int]:
+        """Mã khớp chính xác (không dấu); nếu không có thì các mã chứa chuỗi con."""
+        key = phrase_key(value)
+        if not key:
+            return []
+        if key in self.index:
+            return [self.index[key]]
+        return [code for k, code in self.index.items() if key in k]
+
+
+def _match_codes(codes: np.ndarray, wanted: list[int]) -> np.ndarray:
+    if len(wanted) == 1:
+        return codes == wanted[0]
+    return np.isin(codes, wanted)
+
+
+def _title_hashes(titles: list[str]) -> tuple[list[int], int]:
+    """hash(phrase_key) của từng title + số từ lớn nhất (hash str ổn định trong một process)."""
+    keys = [" ".join(k.split()) for k in norm_keys(titles)]
+    return [hash(k) for k in keys], max((len(k.split()) for k in keys), default=0)
+
+
+class ColumnarCatalog:
+    def __init__(self, ids, titles_blob, title_offsets, prices, stock, author_codes, category_codes,
+                 authors: _Dictionary, categories: _Dictionary, title_hashes, title_max_words: int = 0):
+        self.ids = ids
+        self._titles_blob = titles_blob
+        self._title_offsets = title_offsets
+        self.prices = prices
+        self.stock = stock
+        self.author_codes = author_codes
+        self.category_codes = category_codes
+        self.authors = authors
+        self.categories = categories
+        # Chỉ mục title: hash đã sắp xếp + vị trí tương ứng
+        order = np.argsort(title_hashes, kind="stable")
+        self._title_hash_sorted = title_hashes[order]
+        self._title_hash_pos = order.astype(np.int32)
+        self.title_max_words = min(title_max_words, MAX_PHRASE_WORDS)
+        self.built_at = self.checked_at = time.monotonic()
+        self.change_seq = 0  # book_changes.seq mới nhất đã phản ánh trong catalog
+        self._text_version: Optional[int] = None
+
+    # ----- dựng -----
+    @classmethod
+    def from_rows(cls, rows: Iterable) -> "ColumnarCatalog":
+        """rows: (id, title, author, price, stock, category), theo thứ tự id tăng dần."""
+        authors, categories = _Dictionary(), _Dictionary()
+        ids, prices, stock, a_codes, c_codes, offsets = [], [], [], [], [], [0]
+        hashes, pending, max_words = [], [], 0
+        blob = bytearray()
+        for bid, title, author, price, st, cat in rows:
+            ids.append(bid)
+            prices.append(float(price))
+            stock.append(int(st or 0))
+            a_codes.append(authors.encode(author or ""))
+            c_codes.append(categories.encode(cat or ""))
+            title = title or ""
+            blob += title.encode("utf-8")
+            offsets.append(len(blob))
+            pending.append(title)
+            if len(pending) == _BUILD_CHUNK:
+                h, w = _title_hashes(pending)
+                hashes += h
+                max_words = max(max_words, w)
+                pending = []
+        h, w = _title_hashes(pending)
+        hashes += h
+        max_words = max(max_words, w)
+        return cls(
+            ids=np.asarray(ids, dtype=np.int64),
+            titles_blob=bytes(blob),
+            title_offsets=np.asarray(offsets, dtype=np.int64),
+            prices=np.asarray(prices, dtype=np.float64),
+            stock=np.asarray(stock, dtype=np.int32),
+            author_codes=np.asarray(a_codes, dtype=np.int32),
+            category_codes=np.asarray(c_codes, dtype=np.int32),
+            authors=authors,
+            categories=categories,
+            title_hashes=np.asarray(hashes, dtype=np.int64),
+            title_max_words=max_words,
+        )
+
+    @classmethod
+    def from_db(cls) -> "ColumnarCatalog":
+        with get_db_session() as session:
+            # Đọc seq trước khi dựng: thay đổi xen giữa sẽ được áp lại (idempotent) ở lần kiểm tra sau
+            seq = session.scalar(select(func.max(BookChange.seq))) or 0
+            result = session.execute(
+                select(Book.id, Book.title, Book.author, Book.price, Book.stock, Book.category)
+                .order_by(Book.id)
+                .execution_options(yield_per=_BUILD_CHUNK)
+            )
+            cat = cls.from_rows(result)
+        cat.change_seq = seq
+        return cat
+
+    # ----- truy cập -----
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.ids, self._title_offsets, self.prices, self.stock, self.author_codes, self.category_codes,
+                  self._title_hash_sorted, self._title_hash_pos)
+        return sum(a.nbytes for a in arrays) + len(self._titles_blob)
+
+    @property
+    def text_version(self) -> int:
+        """Checksum phần văn bản (id, title, author, category) — không đổi khi chỉ stock/giá đổi."""
+        if self._text_version is None:
+            crc = zlib.crc32(self.ids.tobytes())
+            crc = zlib.crc32(self._titles_blob, crc)
+            crc = zlib.crc32(self.author_codes.tobytes(), crc)
+            crc = zlib.crc32(self.category_codes.tobytes(), crc)
+            for names in (self.authors.names, self.categories.names):
+                crc = zlib.crc32("\x1f".join(names).encode("utf-8"), crc)
+            self._text_version = crc
+        return self._text_version
+
+    def texts(self) -> Iterator[str]:
+        """'title author category' của từng dòng theo thứ tự vị trí."""
+        a_names, c_names = self.authors.names, self.categories.names
+        for pos in range(len(self.ids)):
+            yield f"{self.title(pos)} {a_names[self.author_codes[pos]]} {c_names[self.category_codes[pos]]}"
+
+    def title(self, pos: int) -> str:
+        start, end = self._title_offsets[pos], self._title_offsets[pos + 1]
+        return self._titles_blob[start:end].decode("utf-8")
+
+    def row(self, pos: int) -> dict:
+        """Một dòng dạng dict giống load_books()."""
+        return {
+            "id": int(self.ids[pos]), "title": self.title(pos),
+            "author": self.authors.names[self.author_codes[pos]],
+            "price": float(self.prices[pos]), "stock": int(self.stock[pos]),
+            "category": self.categories.names[self.category_codes[pos]],
+        }
+
+    def position_of(self, book_id: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.ids, book_id))
+        if pos < len(self.ids) and self.ids[pos] == book_id:
+            return pos
+        return None
+
+    # ----- tra cứu cho chat -----
+    def find_title(self, key: str) -> np.ndarray:
+        """Vị trí (tăng dần) các sách có phrase_key(title) == key."""
+        h = hash(key)
+        lo = np.searchsorted(self._title_hash_sorted, h, side="left")
+        hi = np.searchsorted(self._title_hash_sorted, h, side="right")
+        pos = np.sort(self._title_hash_pos[lo:hi])
+        # Loại va chạm hash
+        return np.asarray([p for p in pos if phrase_key(self.title(int(p))) == key], dtype=np.int64)
+
+    def find_exact(self, query: str) -> np.ndarray:
+        """Vị trí các sách có title, tác giả hoặc thể loại trùng khớp `query` (không dấu)."""
+        key = phrase_key(query)
+        if not key:
+            return np.zeros(0, dtype=np.int64)
+        m = np.zeros(len(self.ids), dtype=bool)
+        m[self.find_title(key)] = True
+        for codes, dictionary in ((self.author_codes, self.authors), (self.category_codes, self.categories)):
+            code = dictionary.index.get(key)
+            if code is not None:
+                m |= codes == code
+        return np.flatnonzero(m)
+
+    def find_title_in(self, text: str) -> Optional[int]:
+        """Vị trí sách có title dài nhất xuất hiện nguyên cụm trong `text` (đã chuẩn hoá)."""
+        for phrase in _phrases(text, self.title_max_words):
+            hits = self.find_title(phrase)
+            if len(hits):
+                return int(hits[0])
+        return None
+
+    def first_with(self, author: Optional[str] = None, category: Optional[str] = None) -> Optional[int]:
+        """Vị trí đầu tiên (theo id) khớp tác giả/thể loại (như mask())."""
+        pos = np.flatnonzero(self.mask(author=author, category=category))
+        return int(pos[0]) if len(pos) else None
+
+    # ----- truy vấn faceted -----
+    def mask(self, min_price: Optional[float] = None, max_price: Optional[float] = None,
+             in_stock: bool = False, category: Optional[str] = None,
+             author: Optional[str] = None) -> np.ndarray:
+        m = np.ones(len(self.ids), dtype=bool)
+        if min_price is not None:
+            m &= self.prices >= min_price
+        if max_price is not None:
+            m &= self.prices <= max_price
+        if in_stock:
+            m &= self.stock > 0
+        if category:
+            m &= _match_codes(self.category_codes, self.categories.lookup(category))
+        if author:
+            m &= _match_codes(self.author_codes, self.authors.lookup(author))
+        return m
+
+    def query(self, min_price: Optional[float] = None, max_price: Optional[float] = None,
+              in_stock: bool = False, category: Optional[str] = None, author: Optional[str] = None,
+              sort: Optional[str] = "price", limit: Optional[int] = 20) -> tuple[int, list[dict]]:
+        """
+        Lọc + sắp xếp vector hoá. sort: "price" | "-price" | "stock" | "-stock" | None (theo id).
+        Trả về (tổng số khớp, tối đa `limit` dòng dạng dict).
+        """
+        pos = np.flatnonzero(self.mask(min_price, max_price, in_stock, category, author))
+        total = len(pos)
+        if sort:
+            desc = sort.startswith("-")
+            col = {"price": self.prices, "stock": self.stock}[sort.lstrip("-")]
+            keys = -col[pos] if desc else col[pos]
+            if limit is not None and limit < total:
+                # chỉ sắp xếp k phần tử nhỏ nhất thay vì cả tập
+                top = np.argpartition(keys, limit)[:limit]
+                pos = pos[top[np.argsort(keys[top], kind="stable")]]
+            else:
+                pos = pos[np.argsort(keys, kind="stable")]
+        if limit is not None:
+            pos = pos[:limit]
+        return total, [self.row(int(p)) for p in pos]
+
+
+# ---------------- cache theo process ----------------
+_catalog: Optional[ColumnarCatalog] = None
+_catalog_lock = threading.Lock()
+_last_prune = 0.0
+
+
+def _refresh(cat: ColumnarCatalog) -> ColumnarCatalog:
+    """Áp các dòng book_changes mới hơn cat.change_seq; trả về catalog dựng lại nếu không vá được."""
+    global _last_prune
+    with get_db_session() as session:
+        first = session.scalar(select(func.min(BookChange.seq)))
+        changes = session.execute(
+            select(BookChange.seq, BookChange.book_id)
+            .where(BookChange.seq > cat.change_seq)
+            .order_by(BookChange.seq)
+            .limit(MAX_PATCH_ROWS + 1)
+        ).all()
+        if time.monotonic() - _last_prune > CHANGE_LOG_PRUNE_SECONDS:
+            _last_prune = time.monotonic()
+            session.execute(delete(BookChange).where(
+                BookChange.seq <= select(func.max(BookChange.seq)).scalar_subquery() - CHANGE_LOG_KEEP
+            ))
+        if not changes:
+            return cat
+        if len(changes) > MAX_PATCH_ROWS or (first is not None and first > cat.change_seq + 1):
+            # Quá nhiều thay đổi, hoặc nhật ký đã bị dọn qua điểm catalog này biết
+            return ColumnarCatalog.from_db()
+        book_ids = {bid for _, bid in changes}
+        rows = {r[0]: r for r in session.execute(
+            select(Book.id, Book.title, Book.author, Book.category, Book.price, Book.stock)
+            .where(Book.id.in_(book_ids))
+        )}
+
+    patches = []
+    for bid in book_ids:
+        pos, row = cat.position_of(bid), rows.get(bid)
+        if pos is None or row is None:
+            return ColumnarCatalog.from_db()  # thêm/xoá sách
+        _, title, author, category, price, stock = row
+        if (title or "") != cat.title(pos) \
+                or cat.authors.index.get(phrase_key(author)) != cat.author_codes[pos] \
+                or cat.categories.index.get(phrase_key(category)) != cat.category_codes[pos]:
+            return ColumnarCatalog.from_db()  # đổi văn bản -> chỉ mục title/dictionary phải dựng lại
+        patches.append((pos, float(price), int(stock or 0)))
+    for pos, price, stock in patches:
+        cat.prices[pos] = price
+        cat.stock[pos] = stock
+    cat.change_seq = changes[-1][0]
+    return cat
+
+
+def get_catalog() -> ColumnarCatalog:
+    """
+    Catalog dùng chung trong process. Tối đa mỗi CATALOG_CHECK_SECONDS đọc book_changes:
+    vá price/stock tại chỗ, chỉ dựng lại khi tập sách hoặc văn bản đổi (hoặc đã bị invalidate).
+    """
+    global _catalog
+    cat = _catalog
+    if cat is not None and time.monotonic() - cat.checked_at < CATALOG_CHECK_SECONDS:
+        return cat
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ColumnarCatalog.from_db()
+        elif time.monotonic() - _catalog.checked_at >= CATALOG_CHECK_SECONDS:
+            _catalog = _refresh(_catalog)
+        _catalog.checked_at = time.monotonic()
+        return _catalog
+
+
+def invalidate_catalog() -> None:
+    global _catalog
+    _catalog = None
+
+
+def apply_stock_delta(book_id: int, delta: int) -> None:
+    """Cập nhật tồn kho trong catalog đã dựng (nếu có) sau khi DB đã commit."""
+    cat = _catalog
+    if cat is None:
+        return
+    pos = cat.position_of(book_id)
+    if pos is None:
+        invalidate_catalog()
+        return
+    cat.stock[pos] += delta
+
+
+# ---------------- benchmark ----------------
+def _bench(n: int = 1_000_000) -> None:
+    rng = np.random.default_rng(0)
+    cats = ["Ky nang", "Tieu thuyet", "Khoa hoc", "Van hoc", "CNTT", "Kinh te", "Thieu nhi", "Lich su"]
+    prices = rng.integers(20, 500, n) * 1000
+    stock = rng.integers(0, 30, n)
+    cat_idx = rng.integers(0, len(cats), n)
+    author_idx = rng.integers(0, 50_000, n)
+
+    def rows():
+        for i in range(n):
+            yield (i + 1, f"Sach so {i + 1}", f"Tac gia {author_idx[i]}", prices[i], stock[i], cats[cat_idx[i]])
+
+    t0 = time.perf_counter()
+    cat = ColumnarCatalog.from_rows(rows())
+    build = time.perf_counter() - t0
+    print(f"build {n:,} books: {build:.2f}s, memory {cat.nbytes / 1e6:.1f} MB")
+
+    cases = [
+        ("Ky nang, <=100k, in stock", dict(category="Ky nang", max_price=100_000, in_stock=True)),
+        ("50k..150k, sort -price", dict(min_price=50_000, max_price=150_000, sort="-price")),
+        ("author 'Tac gia 42'", dict(author="Tac gia 42")),
+    ]
+    for label, kw in cases:
+        reps = 20
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            total, _ = cat.query(**kw)
+        ms = (time.perf_counter() - t0) / reps * 1000
+        print(f"{label:<28} {total:>8,} khớp  {ms:6.2f} ms/query")
+
+    text = norm_key("cho minh mua 2 cuon Sach so 4242 cua Tac gia 42 nhe")
+    for label, fn in [
+        ("find_exact('sach so 777')", lambda: cat.find_exact("sach so 777")),
+        ("find_title_in(câu chat)", lambda: cat.find_title_in(text)),
+        ("authors.find_in(câu chat)", lambda: cat.authors.find_in(text)),
+    ]:
+        reps = 200
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            fn()
+        print(f"{label:<28} {'':>8}       {(time.perf_counter() - t0) / reps * 1000:6.3f} ms/query")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,559 @@
+# app/chat_engine.py
+"""
+Lõi hội thoại rule-based của BookStore (không phụ thuộc Streamlit).
+- Dùng chung cho streamlit_app.py và HTTP server (app.server).
+- Trạng thái hội thoại là một dict-like (st.session_state hoặc dict lưu theo session id),
+  chỉ cần khoá "order_flow" và giá trị phải JSON-serializable.
+- Mọi tra cứu sách trong một lượt chat đi qua catalog dạng cột dùng chung (app.catalog):
+  không dựng list[dict] cả catalog, không lặp Python qua từng title/tác giả.
+"""
+import difflib
+import logging
+import re
+from typing import MutableMapping, Optional
+
+from sqlalchemy import select
+
+from .catalog import get_catalog, apply_stock_delta, phrase_key
+from .copurchase import record_purchase, also_bought
+from .db import get_db_session
+from .models import Book, Order
+from .order_tracking import find_phone, normalize_phone, mask_phone, recent_orders, invalidate_phone
+from .recommender import recommend, get_recommender
+from .textnorm import strip_accents, norm_key, norm_keys
+
+logger = logging.getLogger(__name__)
+
+# Catalog nhỏ hơn mức này: fuzzy quét mọi title; lớn hơn: lấy ứng viên từ chỉ mục TF-IDF
+FUZZY_SCAN_MAX = 5_000
+FUZZY_CANDIDATES = 50
+EXACT_LIST_LIMIT = 20
+HELP_TITLES_LIMIT = 20
+
+
+# ---------------- HELPERS ----------------
+def fmt_price(v) -> str:
+    try:
+        return f"{float(v):,.0f}đ"
+    except Exception:
+        return f"{v}đ"
+
+def fuzzy_suggest(query: str, titles: list[str], n=3, cutoff=0.6) -> list[str]:
+    norm_titles = norm_keys(titles)
+    m = difflib.get_close_matches(norm_key(query), norm_titles, n=n, cutoff=cutoff)
+    out = []
+    for nk in m:
+        for t in titles:
+            if norm_key(t) == nk and t not in out:
+                out.append(t)
+                break
+    return out
+
+def render_book_line(b: dict) -> str:
+    return (
+        f"[BOOK_ID] **{b['id']}** — [TITLE] **{b['title']}** — "
+        f"[AUTHOR] {b['author']} — [CATEGORY] {b['category']} — "
+        f"[PRICE] {fmt_price(b['price'])} — [STOCK] {b['stock']} cuốn"
+    )
+
+# ---------------- DATABASE HELPERS ----------------
+def load_books() -> list[dict]:
+    """Trả về list[dict] (tránh DetachedInstanceError)."""
+    with get_db_session() as session:
+        rows = session.execute(select(Book)).scalars().all()
+        return [
+            {
+                "id": b.id, "title": b.title, "author": b.author,
+                "price": float(b.price), "stock": int(b.stock),
+                "category": b.category,
+            } for b in rows
+        ]
+
+def get_book_by_id(book_id: int):
+    catalog = get_catalog()
+    pos = catalog.position_of(book_id)
+    return catalog.row(pos) if pos is not None else None
+
+def count_books_exact(query: str) -> tuple[int, list[dict]]:
+    """(tổng số khớp, tối đa EXACT_LIST_LIMIT dòng) của smart_search_books_exact."""
+    catalog = get_catalog()
+    pos = catalog.find_exact(query)
+    return len(pos), [catalog.row(int(p)) for p in pos[:EXACT_LIST_LIMIT]]
+
+def smart_search_books_exact(query: str):
+    """So khớp *chính xác* theo title/author/category (không phân biệt dấu), tối đa EXACT_LIST_LIMIT."""
+    return count_books_exact(query)[1]
+
+def suggest_titles(query: str, n: int = 3, cutoff: float = 0.6) -> list[str]:
+    """
+    fuzzy_suggest trên catalog. Catalog lớn: difflib chỉ chạy trên FUZZY_CANDIDATES title gần nhất
+    theo trigram ký tự của recommender thay vì toàn bộ title (index đang dựng lần đầu: chỉ quét
+    FUZZY_SCAN_MAX title đầu).
+    """
+    catalog = get_catalog()
+    rec = get_recommender(catalog, wait=False) if len(catalog) > FUZZY_SCAN_MAX else None
+    if rec is None:
+        titles = [catalog.title(p) for p in range(min(len(catalog), FUZZY_SCAN_MAX))]
+    else:
+        hits = rec.recommend_text(query, k=FUZZY_CANDIDATES)
+        titles = [rec.catalog.title(p) for p, _ in hits]
+    return fuzzy_suggest(query, titles, n=n, cutoff=cutoff)
+
+def help_titles_md(limit: int = HELP_TITLES_LIMIT):
+    catalog = get_catalog()
+    titles = [catalog.title(p) for p in range(min(limit, len(catalog)))]
+    if not titles:
+        return "- (Chưa có dữ liệu)"
+    more = f"\n- … và {len(catalog) - len(titles):,} sách khác" if len(catalog) > len(titles) else ""
+    return "\n".join(f"- {t}" for t in titles) + more
+
+def get_order_status(order_id: int) -> Optional[dict]:
+    """Trạng thái một đơn (kèm tên sách) hoặc None nếu không có."""
+    with get_db_session() as session:
+        row = session.execute(
+            select(Order, Book.title).join(Book, Book.id == Order.book_id).where(Order.id == order_id)
+        ).first()
+        if not row:
+            return None
+        o, title = row
+        return {
+            "id": o.id, "created_at": o.created_at.strftime("%Y-%m-%d %H:%M"),
+            "title": title, "qty": o.quantity, "status": o.status,
+        }
+
+# ---------------- FACET FILTERS (giá / còn hàng / thể loại) ----------------
+_NUM = r"(\d+(?:[.,]\d+)?)\s*(k|nghin|ngan|tr|trieu|d|vnd)?\b"
+PRICE_RANGE_RE = re.compile(r"\b(?:gia\s+)?tu\s+" + _NUM + r"\s*(?:den|toi|-)\s*" + _NUM)
+PRICE_MAX_RE = re.compile(r"(?:\b(?:duoi|toi da|khong qua|re hon|it hon|max)\s*|<=?\s*)" + _NUM)
+PRICE_MIN_RE = re.compile(r"(?:\b(?:tren|it nhat|cao hon|mac hon|min)\s*|>=?\s*)" + _NUM)
+IN_STOCK_RE = re.compile(r"\b(?:con hang|co san|san hang|in stock)\b")
+
+def _to_vnd(num: str, unit: Optional[str]) -> float:
+    v = float(num.replace(",", "."))
+    if unit in ("k", "nghin", "ngan"):
+        return v * 1_000
+    if unit in ("tr", "trieu"):
+        return v * 1_000_000
+    if unit in ("d", "vnd"):
+        return v
+    # Không có đơn vị: "duoi 100" hiểu là 100 nghìn
+    return v * 1_000 if v < 1_000 else v
+
+def parse_filters(text: str) -> dict:
+    """
+    Trích ràng buộc faceted từ câu đã chuẩn hoá (norm_key):
+    {"min_price", "max_price", "in_stock", "category"} — chỉ có các khoá tìm thấy.
+    """
+    filters = {}
+    m = PRICE_RANGE_RE.search(text)
+    if m:
+        lo, hi = _to_vnd(m.group(1), m.group(2)), _to_vnd(m.group(3), m.group(4) or m.group(2))
+        filters["min_price"], filters["max_price"] = min(lo, hi), max(lo, hi)
+    else:
+        m = PRICE_MAX_RE.search(text)
+        if m:
+            filters["max_price"] = _to_vnd(m.group(1), m.group(2))
+        m = PRICE_MIN_RE.search(text)
+        if m:
+            filters["min_price"] = _to_vnd(m.group(1), m.group(2))
+    if IN_STOCK_RE.search(text):
+        filters["in_stock"] = True
+    try:
+        categories = get_catalog().categories
+    except Exception:
+        logger.exception("Catalog error while parsing filters")
+        return filters
+    code = categories.find_in(text)
+    if code is not None and categories.names[code]:
+        filters["category"] = categories.names[code]
+    return filters
+
+def describe_filters(filters: dict) -> str:
+    parts = []
+    if filters.get("category"):
+        parts.append(f"thể loại {filters['category']}")
+    if filters.get("min_price") is not None and filters.get("max_price") is not None:
+        parts.append(f"giá {fmt_price(filters['min_price'])}–{fmt_price(filters['max_price'])}")
+    elif filters.get("max_price") is not None:
+        parts.append(f"giá ≤ {fmt_price(filters['max_price'])}")
+    elif filters.get("min_price") is not None:
+        parts.append(f"giá ≥ {fmt_price(filters['min_price'])}")
+    if filters.get("in_stock"):
+        parts.append("còn hàng")
+    return " • ".join(parts)
+
+def browse_books(filters: dict, limit: int = 10) -> tuple[int, list[dict]]:
+    """Truy vấn catalog dạng cột theo filters của parse_filters(), sắp theo giá tăng dần."""
+    return get_catalog().query(
+        min_price=filters.get("min_price"), max_price=filters.get("max_price"),
+        in_stock=bool(filters.get("in_stock")), category=filters.get("category"),
+        sort="price", limit=limit,
+    )
+
+# ---------------- GỢI Ý SÁCH (TF-IDF offline) ----------------
+RECOMMEND_RE = re.compile(r"\b(?:goi y|de xuat|tu van|gioi thieu|recommend|nen doc)\b")
+SIMILAR_RE = re.compile(r"\b(?:giong|tuong tu|like|similar to)\s+(?:(?:cuon|quyen|sach)\s+)?(.+?)\s*$")
+_RECOMMEND_FILLER_RE = re.compile(
+    r"\b(?:goi y|de xuat|tu van|gioi thieu|recommend|nen doc|cho|toi|minh|me|em|vai|mot|it|cuon|quyen|"
+    r"sach|hay|nao|gi|di|giup|voi|ve|nhe|a|ah)\b"
+)
+
+def _strip_filters(text: str) -> str:
+    """Bỏ các ràng buộc giá/còn hàng khỏi câu (đã được đọc riêng vào filters)."""
+    for rx in (PRICE_RANGE_RE, PRICE_MAX_RE, PRICE_MIN_RE, IN_STOCK_RE):
+        text = rx.sub(" ", text)
+    return " ".join(text.split())
+
+def _recommend_query(text: str) -> str:
+    """Phần còn lại của câu gợi ý sau khi bỏ động từ, từ đệm và ràng buộc giá/còn hàng."""
+    return " ".join(_RECOMMEND_FILLER_RE.sub(" ", _strip_filters(text)).split())
+
+def render_recommendations(nlu: dict, k: int = 5) -> str:
+    filters = {key: v for key, v in nlu["filters"].items() if key != "in_stock"}
+    anchor = smart_search_books_exact(nlu["similar_to"]) if nlu.get("similar_to") else []
+    if anchor:
+        b = anchor[0]
+        recs = recommend(similar_to_id=b["id"], k=k, **filters)
+        head = f"[RECOMMEND] Sách tương tự **{b['title']}**:"
+        if not recs:
+            _, recs = browse_books({**filters, "in_stock": True}, limit=k + 1)
+            recs = [r for r in recs if r["id"] != b["id"]][:k]
+            head = f"[RECOMMEND] Chưa có sách thật sự giống **{b['title']}**; một vài sách đang có sẵn:"
+    elif nlu.get("query"):
+        # Không gợi ý lại chính cuốn có tên trùng câu hỏi
+        qkey = phrase_key(nlu["query"])
+        recs = recommend(nlu["query"], k=k + 1, **filters)
+        recs = [r for r in recs if phrase_key(r["title"]) != qkey][:k]
+        head = f"[RECOMMEND] Gợi ý cho '{nlu['query']}':"
+    else:
+        # Không có chủ đề: gợi ý vài cuốn còn hàng theo filters
+        _, recs = browse_books({**filters, "in_stock": True}, limit=k)
+        head = "[RECOMMEND] Một vài sách đang có sẵn (gõ thêm chủ đề để gợi ý sát hơn):"
+    if not recs:
+        return "[NOT_FOUND] Chưa có gợi ý phù hợp."
+    lines = "\n".join(f"- {render_book_line(r)}" for r in recs)
+    return f"{head}\n\n{lines}\n\n[ORDER] Gõ: **đặt <tên sách>**"
+
+# ---------------- THEO DÕI ĐƠN HÀNG ----------------
+TRACK_RE = re.compile(
+    r"\b(?:don(?: hang)? cua (?:toi|minh|em)|(?:kiem tra|tra cuu|theo doi|tinh trang|trang thai) don(?: hang)?|"
+    r"my orders?|track(?:ing)? orders?|order status)\b"
+)
+
+def render_tracking(phone: str) -> str:
+    orders = recent_orders(phone)
+    if not orders:
+        return f"[NOT_FOUND] Không có đơn hàng nào với SĐT {mask_phone(phone)}."
+    lines = "\n".join(
+        f"- #{o['id']} | {o['created_at']} | **{o['title']}** x{o['qty']} | [STATUS] {o['status']}"
+        for o in orders
+    )
+    return f"[ORDERS] Đơn gần đây của SĐT {mask_phone(phone)}:\n\n{lines}"
+
+# ---------------- RULE-BASED NLU ----------------
+def rule_nlu(user_text: str) -> dict:
+    """
+    {"intent": "order|search|browse|recommend|unknown", "book_title": "", "quantity": None,
+     "customer_name": "", "filters": {...}}
+    "browse": có ràng buộc giá/còn hàng mà không nêu đích danh tên sách.
+    "recommend": xin gợi ý; thêm "similar_to" (tên sách gốc) hoặc "query" (chủ đề tự do).
+    """
+    text = " " + norm_key(user_text) + " "
+    catalog = get_catalog()
+
+    intent = "unknown"
+    book_title, qty, name = "", None, ""
+
+    m_qty = re.search(r"(?:\b(?:mua|dat|order|lay)\b[^0-9]{0,10})?(\d+)\s*(?:cuon|quyen|x)?", text)
+    if m_qty:
+        try:
+            qty = max(1, int(m_qty.group(1)))
+        except Exception:
+            qty = None
+
+    if re.search(r"\b(dat|mua|order|lay|mua giup|muon mua)\b", text):
+        intent = "order"
+    elif re.search(r"\b(tim|kiem|co|con|xem|tra cuu)\b", text) or "sach cua" in text:
+        intent = "search"
+
+    m_name = re.search(r"(toi la|tên|ten|cho)\s+([a-zA-ZÀ-ỹ\s]{2,})", strip_accents(user_text), flags=re.IGNORECASE)
+    if m_name:
+        name = m_name.group(2).strip().title()
+
+    filters = parse_filters(text.strip())
+
+    # Tra từng cụm từ của câu trong chỉ mục title / dictionary tác giả, thể loại của catalog
+    pos = catalog.find_title_in(text)
+    if pos is not None:
+        book_title = catalog.title(pos)
+    title_hit = bool(book_title)
+    if not book_title and ({"min_price", "max_price", "in_stock"} & filters.keys()):
+        intent = "browse"
+    if not book_title and intent != "browse":
+        code = catalog.authors.find_in(text)
+        if code is not None:
+            pos = catalog.first_with(author=catalog.authors.names[code])
+            if pos is not None: book_title = catalog.title(pos)
+    if not book_title and intent != "browse":
+        code = catalog.categories.find_in(text)
+        if code is not None:
+            pos = catalog.first_with(category=catalog.categories.names[code])
+            if pos is not None: book_title = catalog.title(pos)
+    if not book_title and intent != "browse":
+        sugg = suggest_titles(user_text, n=1, cutoff=0.65)
+        if sugg: book_title = sugg[0]
+
+    out = {"intent": intent, "book_title": book_title, "quantity": qty, "customer_name": name, "filters": filters}
+
+    m_similar = SIMILAR_RE.search(text.strip())
+    if m_similar or RECOMMEND_RE.search(text):
+        out["intent"] = "recommend"
+        out["similar_to"], out["query"] = "", ""
+        if m_similar:
+            # "giống X dưới 200k còn hàng": giá/còn hàng đã vào filters, chỉ X là tên sách
+            target = _strip_filters(m_similar.group(1))
+            exact = catalog.find_title(phrase_key(target)) if target else []
+            hits = [catalog.title(int(exact[0]))] if len(exact) else (
+                suggest_titles(target, n=1, cutoff=0.65) if target else [])
+            if hits:
+                out["similar_to"] = hits[0]
+            else:
+                out["query"] = _recommend_query(target)
+        elif title_hit:
+            out["similar_to"] = book_title
+        else:
+            out["query"] = _recommend_query(text)
+    return out
+
+# --------- PARSER MỆNH LỆNH ĐẶT HÀNG (chắc chắn vào flow đặt) ---------
+ORDER_VERB_RE = re.compile(r"(?:^|\s)(dat|mua|order|lay)\b", re.IGNORECASE)
+def parse_order_command(raw: str):
+    """
+    Trả về (book_query:str, qty_hint:Optional[int]) nếu phát hiện 'đặt/mua ...', ngược lại (None, None).
+    Bắt cả mẫu: 'đặt 2 (cuốn|quyển|x) <tên sách>'
+    """
+    noacc = strip_accents(raw).lower().strip()
+    m = ORDER_VERB_RE.search(noacc)
+    if not m:
+        return None, None
+    tail = noacc[m.end():].strip()
+    if not tail:
+        return "", None
+    m2 = re.match(r"(\d+)\s*(?:cuon|quyen|x)?\s*(.*)", tail)
+    qty_hint, book_query = None, tail
+    if m2:
+        try:
+            qty_hint = max(1, int(m2.group(1)))
+        except Exception:
+            qty_hint = None
+        book_query = (m2.group(2) or "").strip()
+    return book_query, qty_hint
+
+# ---------------- CHAT TURN ----------------
+def welcome_message() -> str:
+    return f"""Xin chào! Tôi là trợ lý của BookStore.
+
+Tra cứu:
+- Theo ID: gõ số hoặc `id: <số>`
+- Theo tiêu đề/author/category (không phân biệt dấu)
+- Ví dụ: `Dale Carnegie`, `Ky nang`, `Dac Nhan Tam`
+
+Đặt hàng:
+- Gõ **đặt <tên sách>** hoặc câu tự nhiên: "mua 2 cuốn Dac Nhan Tam"
+
+Gợi ý:
+- "goi y sach giong Dac Nhan Tam", "tu van sach khoa hoc duoi 200k"
+
+Theo dõi đơn:
+- "don hang cua toi 0123456789"
+
+Sách hiện có:
+{help_titles_md()}
+"""
+
+def handle_message(state: MutableMapping, prompt: str) -> str:
+    """
+    Xử lý một lượt chat và trả về câu trả lời (markdown).
+    `state["order_flow"]` = {'step','book','qty','name'} (hoặc {'step': 'ask_track_phone'}) hay None,
+    được cập nhật tại chỗ.
+    """
+    user_input = prompt.strip()
+    response = ""
+    nk = norm_key(user_input)
+
+    # ---- THEO DÕI ĐƠN (trước lệnh đặt hàng vì câu có thể chứa "dat hang") ----
+    tracking = bool(TRACK_RE.search(nk))
+    book_query, qty_hint = (None, None) if tracking else parse_order_command(user_input)
+    if tracking:
+        phone = find_phone(user_input)
+        if phone:
+            state["order_flow"] = None
+            response = render_tracking(phone)
+        else:
+            state["order_flow"] = {"step": "ask_track_phone"}
+            response = "[INPUT] Nhập **SĐT** đã dùng khi đặt hàng để xem các đơn gần đây."
+    # ---- ƯU TIÊN: MỆNH LỆNH ĐẶT HÀNG ----
+    elif book_query is not None:
+        found = smart_search_books_exact(book_query)
+        if not found:
+            sugg = suggest_titles(book_query, n=3, cutoff=0.55)
+            if len(sugg) == 1:
+                found = smart_search_books_exact(sugg[0])
+
+        if len(found) == 1:
+            b = found[0]
+            state["order_flow"] = {"step": "ask_qty", "book": b}
+            preset = ""
+            if isinstance(qty_hint, int) and 1 <= qty_hint <= b["stock"]:
+                state["order_flow"]["qty"] = qty_hint
+                state["order_flow"]["step"] = "ask_name"
+                preset = f"[PRESET] Số lượng: {qty_hint}\n"
+
+            next_line = "Nhập **tên khách hàng**." if "qty" in state["order_flow"] else f"Nhập **số lượng** (1–{b['stock']})."
+            response = f"""[ORDER] Chuẩn bị đặt hàng:
+
+{render_book_line(b)}
+{preset}[NEXT] {next_line}"""
+        elif len(found) == 0:
+            sugg = suggest_titles(book_query, n=3, cutoff=0.55)
+            bullet = "\n".join(f"- {s}" for s in sugg) if sugg else "- (không có gợi ý gần)"
+            response = f"[NOT_FOUND] Không tìm thấy sách '{book_query}'.\n\n[GỢI Ý]\n{bullet}"
+        else:
+            response = "[ERROR] Nhiều kết quả. Gõ tên chính xác hoặc chọn theo ID."
+    else:
+        # ---- ORDER FLOW ----
+        flow = state.get("order_flow")
+        if flow and flow.get("step") == "ask_track_phone":
+            phone = normalize_phone(user_input)
+            if phone:
+                state["order_flow"] = None
+                response = render_tracking(phone)
+            else:
+                response = "[WARNING] Nhập **SĐT (9–11 số)** đã dùng khi đặt hàng."
+        elif flow and flow.get("step") == "ask_qty":
+            if user_input.isdigit():
+                qty = int(user_input)
+                if 1 <= qty <= flow["book"]["stock"]:
+                    flow["qty"] = qty
+                    flow["step"] = "ask_name"
+                    response = "[INPUT] Vui lòng nhập **tên khách hàng**."
+                else:
+                    response = f"[WARNING] Số lượng phải từ 1 đến {flow['book']['stock']}."
+            else:
+                response = "[WARNING] Vui lòng nhập **số nguyên** cho số lượng."
+        elif flow and flow.get("step") == "ask_name":
+            if len(user_input) >= 2:
+                flow["name"] = user_input
+                flow["step"] = "ask_contact"
+                response = "[INPUT] Nhập **SĐT và địa chỉ** (VD: `0123456789 Ha Noi`)."
+            else:
+                response = "[WARNING] Tên quá ngắn. Vui lòng nhập lại."
+        elif flow and flow.get("step") == "ask_contact":
+            tokens = user_input.split()
+            if tokens:
+                phone_raw = tokens[0]
+                phone = re.sub(r"\D", "", phone_raw)  # chỉ giữ chữ số
+                address = " ".join(tokens[1:]).strip()
+                if not (9 <= len(phone) <= 11) or len(address) < 3:
+                    response = "[WARNING] Nhập **SĐT (9–11 số)** và **địa chỉ** hợp lệ. Ví dụ: `0123456789 Ha Noi`"
+                else:
+                    try:
+                        placed = None
+                        with get_db_session() as session:
+                            book = session.get(Book, flow["book"]["id"])
+                            if book and book.stock >= flow["qty"]:
+                                session.add(
+                                    Order(
+                                        customer_name=flow["name"], phone=phone, address=address,
+                                        book_id=book.id, quantity=flow["qty"], status="pending",
+                                    )
+                                )
+                                book.stock -= flow["qty"]
+                                record_purchase(session, phone, flow["name"], book.id)
+                                placed = (book.id, flow["qty"])
+                                response = f"""[SUCCESS] ĐẶT HÀNG THÀNH CÔNG!
+
+{render_book_line({"id": book.id, "title": book.title, "author": book.author, "category": book.category, "price": float(book.price), "stock": book.stock})}
+[QTY] {flow["qty"]}
+[CUSTOMER] {flow["name"]}
+[CONTACT] {phone} | {address}
+"""
+                                state["order_flow"] = None
+                            else:
+                                response = "[ERROR] Sách không đủ tồn kho."
+                        if placed:
+                            apply_stock_delta(placed[0], -placed[1])
+                            invalidate_phone(phone)
+                            recs = also_bought(placed[0], k=3)
+                            if recs:
+                                lines = "\n".join(f"- {render_book_line(r)}" for r in recs)
+                                response += f"\n[ALSO_BOUGHT] Khách mua sách này cũng mua:\n\n{lines}\n"
+                    except Exception as e:
+                        response = f"[ERROR] Lỗi đặt hàng: {e}"
+            else:
+                response = "[WARNING] Nhập SĐT và địa chỉ."
+        else:
+            # ---- TRA CỨU ----
+            id_match = re.match(r"^(?:id:\s*)?(\d+)$", nk)
+            if id_match:
+                b = get_book_by_id(int(id_match.group(1)))
+                if b:
+                    response = f"[FOUND] Tìm thấy theo ID:\n\n{render_book_line(b)}\n\n[ORDER] Gõ: **đặt {b['title']}**"
+                else:
+                    response = "[NOT_FOUND] Không có sách với ID đó."
+            else:
+                total, exact = count_books_exact(user_input)
+                if total == 1:
+                    b = exact[0]
+                    response = f"[FOUND] Tìm thấy:\n\n{render_book_line(b)}\n\n[ORDER] Gõ: **đặt {b['title']}**"
+                elif total > 1:
+                    lines = "\n".join(f"- {render_book_line(b)}" for b in exact)
+                    more = f"\n\n(Hiển thị {len(exact)}/{total})" if total > len(exact) else ""
+                    response = f"[FOUND] Có {total} sách phù hợp:\n\n{lines}{more}\n\n[ORDER] Gõ: **đặt <tên sách>**"
+                else:
+                    nlu = rule_nlu(user_input)
+                    if nlu and nlu.get("intent") == "recommend":
+                        response = render_recommendations(nlu)
+                    elif nlu and nlu.get("intent") == "browse":
+                        total, rows = browse_books(nlu["filters"])
+                        desc = describe_filters(nlu["filters"])
+                        if rows:
+                            lines = "\n".join(f"- {render_book_line(b)}" for b in rows)
+                            more = f"\n\n(Hiển thị {len(rows)}/{total}, giá thấp trước)" if total > len(rows) else ""
+                            response = f"[FOUND] Có {total} sách phù hợp ({desc}):\n\n{lines}{more}\n\n[ORDER] Gõ: **đặt <tên sách>**"
+                        else:
+                            response = f"[NOT_FOUND] Không có sách phù hợp ({desc})."
+                    elif nlu and nlu.get("book_title"):
+                        found = smart_search_books_exact(nlu["book_title"])
+                        if found:
+                            b = found[0]
+                            if nlu.get("intent") == "search":
+                                response = f"[FOUND] Tìm thấy:\n\n{render_book_line(b)}\n\n[ORDER] Gõ: **đặt {b['title']}**"
+                            else:
+                                flow = {"step": "ask_qty", "book": b}
+                                if isinstance(nlu.get("quantity"), int) and 1 <= nlu["quantity"] <= b["stock"]:
+                                    flow["qty"] = nlu["quantity"]; flow["step"] = "ask_name"
+                                if nlu.get("customer_name"):
+                                    flow["name"] = nlu["customer_name"]
+                                    if "qty" in flow: flow["step"] = "ask_contact"
+                                state["order_flow"] = flow
+                                preset = ""
+                                if "qty" in flow:  preset += f"[PRESET] Số lượng: {flow['qty']}\n"
+                                if "name" in flow: preset += f"[PRESET] Tên KH: {flow['name']}\n"
+                                next_line = {
+                                    "ask_qty": f"Nhập **số lượng** (1–{b['stock']})",
+                                    "ask_name": "Nhập **tên khách hàng**",
+                                    "ask_contact": "Nhập **SĐT và địa chỉ** (VD: `0123456789 Ha Noi`)",
+                                }[flow["step"]]
+                                response = f"""[ORDER] Chuẩn bị đặt hàng:
+
+{render_book_line(b)}
+{preset}[NEXT] {next_line}"""
+                        else:
+                            response = "[NOT_FOUND] Không map được vào DB."
+                    else:
+                        sugg = suggest_titles(user_input)
+                        bullet = "\n".join(f"- {s}" for s in sugg) if sugg else "- (không có gợi ý gần)"
+                        response = f"[NOT_FOUND] Không tìm thấy.\n\n[GỢI Ý]\n{bullet}"
+
+    return response
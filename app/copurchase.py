@@ -0,0 +1,247 @@
+# app/copurchase.py
+"""
+"Khách mua sách này cũng mua": bảng đồng xuất hiện (book_copurchase) cập nhật tăng dần.
+
+- customer_books: (khách, sách) -> số đơn chưa huỷ. Khách = SĐT (chỉ chữ số), nếu không có thì tên.
+- Mỗi khách chỉ góp cặp từ MAX_CUSTOMER_BOOKS sách có book_id nhỏ nhất đang sở hữu ("tập giới
+  hạn", giống rebuild()). Khi X vào tập (đơn mới / mở lại đơn huỷ) -> +1 cho cặp (X, Y) với mỗi Y
+  trong tập; khi X rời tập (huỷ đơn cuối, hoặc bị sách id nhỏ hơn đẩy ra) -> -1. Vì bảng luôn là
+  hàm của tập sở hữu hiện tại, cập nhật tăng dần và rebuild() cho cùng kết quả. Mỗi thao tác chỉ
+  đọc tối đa MAX_CUSTOMER_BOOKS + 1 sách của khách đó (qua khoá chính), không quét bảng orders.
+- also_bought(): đọc top-k qua index (book_a, count) + cache nhỏ trong process.
+- rebuild(): dựng lại toàn bộ từ orders (CLI: python -m app.copurchase --rebuild).
+
+Các hàm record_* nhận session đang mở để cập nhật cùng transaction với đơn hàng.
+"""
+import argparse
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from itertools import combinations
+from typing import Optional
+
+from sqlalchemy import select, delete, update, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .db import get_db_session, init_db
+from .models import Book, Order, CustomerBook, CoPurchase
+from .textnorm import norm_key
+
+MAX_CUSTOMER_BOOKS = 50
+TOP_K_CACHE_SIZE = 4096
+TOP_K_CACHE_TTL = 60.0
+_REBUILD_CHUNK = 5_000
+
+
+def customer_key(phone: Optional[str], customer_name: Optional[str]) -> str:
+    digits = re.sub(r"\D", "", phone or "")
+    return f"p:{digits}" if digits else f"n:{norm_key(customer_name)}"
+
+
+# ---------------- cập nhật tăng dần ----------------
+def _adjust_pairs(session: Session, book_id: int, others: list[int], delta: int) -> None:
+    if not others:
+        return
+    pairs = [(book_id, o) for o in others] + [(o, book_id) for o in others]
+    if delta > 0:
+        stmt = insert(CoPurchase)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[CoPurchase.book_a, CoPurchase.book_b],
+                set_={"count": CoPurchase.count + stmt.excluded.count},
+            ),
+            [{"book_a": a, "book_b": b, "count": delta} for a, b in pairs],
+        )
+    else:
+        key = tuple_(CoPurchase.book_a, CoPurchase.book_b)
+        session.execute(update(CoPurchase).where(key.in_(pairs)).values(count=CoPurchase.count + delta))
+        session.execute(delete(CoPurchase).where(key.in_(pairs), CoPurchase.count <= 0))
+    invalidate_top_k([book_id, *others])
+
+
+def _smallest_books(session: Session, ckey: str) -> list[int]:
+    """MAX_CUSTOMER_BOOKS + 1 book_id nhỏ nhất khách đang sở hữu (phần tử cuối = ứng viên kế tiếp)."""
+    return list(session.execute(
+        select(CustomerBook.book_id)
+        .where(CustomerBook.customer_key == ckey)
+        .order_by(CustomerBook.book_id)
+        .limit(MAX_CUSTOMER_BOOKS + 1)
+    ).scalars())
+
+
+def record_purchase(session: Session, phone: str, customer_name: str, book_id: int) -> None:
+    """Gọi khi một đơn trở thành active (tạo mới hoặc mở lại từ canceled)."""
+    ckey = customer_key(phone, customer_name)
+    row = session.get(CustomerBook, (ckey, book_id))
+    if row is not None:
+        row.n_orders += 1
+        return
+    capped = _smallest_books(session, ckey)[:MAX_CUSTOMER_BOOKS]
+    session.add(CustomerBook(customer_key=ckey, book_id=book_id, n_orders=1))
+    session.flush()  # SessionLocal autoflush=False: lượt record_* kế tiếp trong cùng transaction phải thấy
+    if len(capped) < MAX_CUSTOMER_BOOKS:
+        _adjust_pairs(session, book_id, capped, +1)
+    elif book_id < capped[-1]:
+        # Tập đã đầy: book_id vào, sách id lớn nhất trong tập bị đẩy ra
+        rest = capped[:-1]
+        _adjust_pairs(session, capped[-1], rest, -1)
+        _adjust_pairs(session, book_id, rest, +1)
+
+
+def record_cancel(session: Session, phone: str, customer_name: str, book_id: int) -> None:
+    """Gọi khi một đơn active bị huỷ."""
+    ckey = customer_key(phone, customer_name)
+    row = session.get(CustomerBook, (ckey, book_id))
+    if row is None:
+        return
+    if row.n_orders > 1:
+        row.n_orders -= 1
+        return
+    books = _smallest_books(session, ckey)
+    session.delete(row)
+    session.flush()
+    capped = books[:MAX_CUSTOMER_BOOKS]
+    if book_id not in capped:
+        return
+    rest = [b for b in capped if b != book_id]
+    _adjust_pairs(session, book_id, rest, -1)
+    if len(books) > MAX_CUSTOMER_BOOKS:
+        # Sách kế tiếp ngoài tập được đưa vào thay chỗ
+        _adjust_pairs(session, books[MAX_CUSTOMER_BOOKS], rest, +1)
+
+
+def record_status_change(session: Session, order: Order, prev: str, new: str) -> None:
+    """Theo đúng quy tắc tồn kho: active <-> canceled."""
+    if prev != "canceled" and new == "canceled":
+        record_cancel(session, order.phone, order.customer_name, order.book_id)
+    elif prev == "canceled" and new != "canceled":
+        record_purchase(session, order.phone, order.customer_name, order.book_id)
+
+
+# ---------------- tra cứu top-k ----------------
+_top_k_cache: "OrderedDict[int, tuple[float, int, list[tuple[int, int]]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def invalidate_top_k(book_ids=None) -> None:
+    with _cache_lock:
+        if book_ids is None:
+            _top_k_cache.clear()
+        else:
+            for b in book_ids:
+                _top_k_cache.pop(b, None)
+
+
+def top_k_ids(book_id: int, k: int = 5) -> list[tuple[int, int]]:
+    """[(book_b, count)] theo count giảm dần; O(k) qua index (book_a, count) hoặc cache."""
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _top_k_cache.get(book_id)
+        # Mục cache đủ dùng khi đã hỏi >= k dòng, hoặc DB trả ít hơn số đã hỏi (đã là toàn bộ)
+        if hit and now - hit[0] < TOP_K_CACHE_TTL and (hit[1] >= k or len(hit[2]) < hit[1]):
+            _top_k_cache.move_to_end(book_id)
+            return hit[2][:k]
+    with get_db_session() as session:
+        rows = [tuple(r) for r in session.execute(
+            select(CoPurchase.book_b, CoPurchase.count)
+            .where(CoPurchase.book_a == book_id)
+            .order_by(CoPurchase.count.desc())
+            .limit(k)
+        )]
+    with _cache_lock:
+        _top_k_cache[book_id] = (now, k, rows)
+        _top_k_cache.move_to_end(book_id)
+        while len(_top_k_cache) > TOP_K_CACHE_SIZE:
+            _top_k_cache.popitem(last=False)
+    return rows
+
+
+def also_bought(book_id: int, k: int = 3, in_stock: bool = True) -> list[dict]:
+    """Sách khách khác mua cùng `book_id`, dạng dict như load_books() + "copurchases"."""
+    ranked = top_k_ids(book_id, k * 2 if in_stock else k)
+    if not ranked:
+        return []
+    with get_db_session() as session:
+        books = {b.id: b for b in session.execute(
+            select(Book).where(Book.id.in_([b for b, _ in ranked]))
+        ).scalars()}
+    out = []
+    for bid, cnt in ranked:
+        b = books.get(bid)
+        if b is None or (in_stock and b.stock <= 0):
+            continue
+        out.append({
+            "id": b.id, "title": b.title, "author": b.author,
+            "price": float(b.price), "stock": int(b.stock), "category": b.category,
+            "copurchases": cnt,
+        })
+        if len(out) == k:
+            break
+    return out
+
+
+# ---------------- dựng lại toàn bộ ----------------
+def rebuild() -> tuple[int, int]:
+    """Xoá và dựng lại customer_books + book_copurchase từ các đơn chưa huỷ. Trả về (số khách, số cặp)."""
+    owned: dict[str, Counter] = {}
+    with get_db_session() as session:
+        result = session.execute(
+            select(Order.phone, Order.customer_name, Order.book_id)
+            .where(Order.status != "canceled")
+            .execution_options(yield_per=_REBUILD_CHUNK)
+        )
+        for phone, name, book_id in result:
+            owned.setdefault(customer_key(phone, name), Counter())[book_id] += 1
+
+    pairs: Counter = Counter()
+    for books in owned.values():
+        ids = sorted(books)[:MAX_CUSTOMER_BOOKS]
+        for a, b in combinations(ids, 2):
+            pairs[(a, b)] += 1
+            pairs[(b, a)] += 1
+
+    with get_db_session() as session:
+        session.execute(delete(CoPurchase))
+        session.execute(delete(CustomerBook))
+        cb_rows = [
+            {"customer_key": ck, "book_id": b, "n_orders": n}
+            for ck, books in owned.items() for b, n in books.items()
+        ]
+        if cb_rows:
+            session.execute(insert(CustomerBook), cb_rows)
+        if pairs:
+            session.execute(
+                insert(CoPurchase), [{"book_a": a, "book_b": b, "count": c} for (a, b), c in pairs.items()]
+            )
+    invalidate_top_k()
+    return len(owned), len(pairs) // 2
+
+
+def clear(session: Session) -> None:
+    """Xoá toàn bộ đồ thị (dùng khi admin xoá hết đơn)."""
+    session.execute(delete(CoPurchase))
+    session.execute(delete(CustomerBook))
+    invalidate_top_k()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Co-purchase table maintenance")
+    parser.add_argument("--rebuild", action="store_true", help="dựng lại từ bảng orders")
+    parser.add_argument("--book", type=int, help="in top-k cho một book id")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.rebuild:
+        t0 = time.perf_counter()
+        customers, n_pairs = rebuild()
+        print(f"rebuilt: {customers} customers, {n_pairs} book pairs in {time.perf_counter() - t0:.2f}s")
+    if args.book is not None:
+        for b in also_bought(args.book, k=args.k, in_stock=False):
+            print(f"{b['copurchases']:>5}  #{b['id']} {b['title']}")
+
+
+if __name__ == "__main__":
+    main()
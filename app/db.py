@@ -4,7 +4,7 @@ import shutil
 from pathlib import Path
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
 
@@ -47,6 +47,15 @@ def get_database_url() -> str:
 
 engine = create_engine(get_database_url(), echo=False, future=True)
 
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record) -> None:
+    """WAL + busy_timeout: cho phép nhiều process (app.server --workers) đọc/ghi cùng DB."""
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
+
 # Quan trọng: không expire object sau commit để tránh DetachedInstanceError
 SessionLocal = sessionmaker(
     bind=engine,
@@ -75,3 +84,10 @@ def init_db() -> None:
     # Import trong hàm để tránh vòng lặp import
     from . import models  # noqa: F401
     Base.metadata.create_all(bind=engine)
+    # create_all bỏ qua bảng đã tồn tại -> tạo bù các index mới thêm cho DB cũ
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        for ddl in (*models.ORDER_STAMP_TRIGGERS, *models.BOOK_CHANGE_TRIGGERS):
+            conn.execute(text(ddl))
@@ -0,0 +1,149 @@
+# app/export.py
+"""
+Export streaming đơn hàng / catalog ra CSV hoặc JSONL với bộ nhớ không đổi.
+
+- Đọc bằng server-side cursor: execution_options(yield_per=CHUNK_ROWS) + Result.partitions(),
+  mỗi lần chỉ giữ CHUNK_ROWS dòng.
+- Mỗi partition được render thành một khối bytes và yield ngay -> bắt đầu tải xuống tức thì.
+- Dùng chung cho CLI, HTTP server (GET /export/...) và nút tải trong tab Admin.
+
+CLI:
+    python -m app.export orders --format csv --status pending --since 2026-01-01 -o orders.csv
+    python -m app.export books --format jsonl > books.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from .db import get_db_session
+from .models import Book, Order
+
+CHUNK_ROWS = 1000
+FORMATS = ("csv", "jsonl")
+KINDS = ("orders", "books")
+ORDER_STATUSES = ("pending", "confirmed", "canceled", "shipped")
+
+ORDER_FIELDS = ["id", "created_at", "status", "book_id", "title", "quantity", "customer_name", "phone", "address"]
+BOOK_FIELDS = ["id", "title", "author", "category", "price", "stock"]
+
+MIME_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """'YYYY-MM-DD' -> date; rỗng -> None; sai định dạng -> ValueError."""
+    if not value:
+        return None
+    return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+
+
+def _order_partitions(status: Optional[str], since: Optional[date], until: Optional[date], chunk: int):
+    stmt = (
+        select(Order.id, Order.created_at, Order.status, Order.book_id, Book.title,
+               Order.quantity, Order.customer_name, Order.phone, Order.address)
+        .join(Book, Book.id == Order.book_id)
+        .order_by(Order.id)
+    )
+    if status:
+        stmt = stmt.where(Order.status == status)
+    if since:
+        stmt = stmt.where(Order.created_at >= datetime.combine(since, datetime.min.time()))
+    if until:
+        # until tính cả ngày đó
+        stmt = stmt.where(Order.created_at < datetime.combine(until + timedelta(days=1), datetime.min.time()))
+    with get_db_session() as session:
+        result = session.execute(stmt.execution_options(yield_per=chunk))
+        for part in result.partitions():
+            yield [
+                [oid, created.isoformat(sep=" ", timespec="seconds"), st, bid, title, qty, name, phone, addr]
+                for oid, created, st, bid, title, qty, name, phone, addr in part
+            ]
+
+
+def _book_partitions(chunk: int):
+    stmt = select(Book.id, Book.title, Book.author, Book.category, Book.price, Book.stock).order_by(Book.id)
+    with get_db_session() as session:
+        result = session.execute(stmt.execution_options(yield_per=chunk))
+        for part in result.partitions():
+            yield [[bid, title, author, cat, float(price), int(stock)] for bid, title, author, cat, price, stock in part]
+
+
+def _encode(partitions, fields: list[str], fmt: str) -> Iterator[bytes]:
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(fields)
+        # BOM để Excel nhận đúng UTF-8 tiếng Việt
+        yield "\ufeff".encode("utf-8") + buf.getvalue().encode("utf-8")
+        for rows in partitions:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows(rows)
+            yield buf.getvalue().encode("utf-8")
+    else:
+        for rows in partitions:
+            yield "".join(
+                json.dumps(dict(zip(fields, r)), ensure_ascii=False) + "\n" for r in rows
+            ).encode("utf-8")
+
+
+def export_stream(kind: str, fmt: str = "csv", status: Optional[str] = None,
+                  since: Optional[str] = None, until: Optional[str] = None,
+                  chunk: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Generator các khối bytes (mỗi khối ~`chunk` dòng). Tham số được kiểm tra ngay khi gọi
+    (ValueError) chứ không phải lúc bắt đầu lặp, để caller trả lỗi trước khi gửi header.
+    status/since/until chỉ áp dụng cho kind="orders".
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    status = (status or "").strip().lower() or None
+    if status and status not in ORDER_STATUSES:
+        raise ValueError(f"status must be one of {ORDER_STATUSES}")
+    since_d, until_d = parse_date(since), parse_date(until)
+
+    if kind == "orders":
+        return _encode(_order_partitions(status, since_d, until_d, chunk), ORDER_FIELDS, fmt)
+    return _encode(_book_partitions(chunk), BOOK_FIELDS, fmt)
+
+
+def export_filename(kind: str, fmt: str) -> str:
+    return f"{kind}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}"
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Stream orders / catalog to CSV or JSONL")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--status", choices=ORDER_STATUSES)
+    parser.add_argument("--since", help="YYYY-MM-DD (orders)")
+    parser.add_argument("--until", help="YYYY-MM-DD, tính cả ngày này (orders)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS)
+    parser.add_argument("-o", "--output", help="file đích (mặc định stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        chunks = export_stream(args.kind, args.format, args.status, args.since, args.until, args.chunk)
+    except ValueError as e:
+        parser.error(str(e))
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for block in chunks:
+            out.write(block)
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# app/loadtest.py
+"""
+Load test cục bộ cho app.server (asyncio, keep-alive, không cần thư viện ngoài).
+
+    # tự khởi động server tạm trên cổng trống rồi đo
+    python -m app.loadtest --spawn --workers 2 --duration 10
+
+    # hoặc đo một server đang chạy
+    python -m app.loadtest --port 8080 --server-workers 4
+
+In ra requests/sec tổng và requests/sec mỗi core (= worker). Lưu ý client chạy trên cùng máy
+nên cũng chiếm CPU; nên để số worker < số core.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+SCENARIOS = {
+    "health": ("GET", "/health", None),
+    "chat": ("POST", "/chat", "Dac Nhan Tam"),
+    "order": ("POST", "/chat", "dat 1 Nha Gia Kim"),
+}
+
+
+def _build_request(host: str, port: int, method: str, path: str, message, session_id: str) -> bytes:
+    body = b""
+    if message is not None:
+        body = json.dumps({"session_id": session_id, "message": message}).encode("utf-8")
+    head = (
+        f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("server closed connection")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = h.decode("latin-1").partition(":")
+        if k.strip().lower() == "content-length":
+            length = int(v.strip())
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def _client(host, port, scenario, deadline, latencies, errors):
+    method, path, message = SCENARIOS[scenario]
+    req = _build_request(host, port, method, path, message, uuid.uuid4().hex)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            writer.write(req)
+            await writer.drain()
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - t0)
+            if status >= 400:
+                errors[0] += 1
+    finally:
+        writer.close()
+
+
+async def run_load(host: str, port: int, concurrency: int, duration: float, scenario: str) -> dict:
+    latencies: list[float] = []
+    errors = [0]
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[
+        _client(host, port, scenario, deadline, latencies, errors) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    n = len(latencies)
+
+    def pct(p):
+        return latencies[min(n - 1, int(n * p))] * 1000 if n else 0.0
+
+    return {
+        "requests": n, "errors": errors[0], "elapsed_s": elapsed,
+        "rps": n / elapsed if elapsed else 0.0,
+        "p50_ms": pct(0.50), "p99_ms": pct(0.99),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(host: str, port: int, timeout: float = 15.0) -> None:
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on {host}:{port} did not start")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Local load test for app.server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="chat")
+    parser.add_argument("--spawn", action="store_true", help="tự chạy app.server trên cổng trống")
+    parser.add_argument("--workers", type=int, default=1, help="số worker khi --spawn")
+    parser.add_argument("--server-workers", type=int, default=None, help="số worker của server đang chạy (để tính rps/core)")
+    args = parser.parse_args(argv)
+
+    proc = None
+    port = args.port
+    workers = args.server_workers or args.workers
+    if args.spawn:
+        port = _free_port()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "app.server", "--host", args.host, "--port", str(port), "--workers", str(args.workers)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    try:
+        _wait_ready(args.host, port)
+        res = asyncio.run(run_load(args.host, port, args.concurrency, args.duration, args.scenario))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    cores = min(workers, os.cpu_count() or 1)
+    print(f"scenario={args.scenario} workers={workers} concurrency={args.concurrency} duration={res['elapsed_s']:.1f}s")
+    print(f"requests={res['requests']} errors={res['errors']}")
+    print(f"throughput: {res['rps']:,.0f} req/s  ({res['rps'] / cores:,.0f} req/s per core)")
+    print(f"latency: p50={res['p50_ms']:.2f}ms p99={res['p99_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
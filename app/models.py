@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Integer, String, DateTime, ForeignKey, Numeric
+from sqlalchemy import Integer, String, DateTime, ForeignKey, Numeric, Text, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
@@ -24,6 +24,8 @@ class Book(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    # Tra cứu "đơn hàng của tôi": WHERE phone = ? ORDER BY created_at DESC LIMIT n
+    __table_args__ = (Index("ix_orders_phone_created_at", "phone", "created_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     customer_name: Mapped[str] = mapped_column(String(255))
@@ -41,3 +43,90 @@ class Order(Base):
         return f"Order(id={self.id}, book_id={self.book_id}, qty={self.quantity})"
 
 
+class OrderStamp(Base):
+    """
+    Phiên bản đơn hàng theo SĐT, do trigger trên orders tăng mỗi khi thêm/sửa/xoá đơn.
+    Cache của app.order_tracking so phiên bản này nên mọi process thấy thay đổi ngay.
+    """
+    __tablename__ = "order_stamps"
+
+    phone: Mapped[str] = mapped_column(String(50), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
+def _bump_stamp(ref: str) -> str:
+    return (f"INSERT INTO order_stamps (phone, version) VALUES ({ref}.phone, 1) "
+            "ON CONFLICT(phone) DO UPDATE SET version = version + 1;")
+
+
+# init_db() tạo (IF NOT EXISTS) để DB cũ cũng có
+ORDER_STAMP_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS trg_orders_stamp_insert AFTER INSERT ON orders "
+    f"BEGIN {_bump_stamp('NEW')} END",
+    f"CREATE TRIGGER IF NOT EXISTS trg_orders_stamp_update AFTER UPDATE ON orders "
+    f"BEGIN {_bump_stamp('NEW')} END",
+    f"CREATE TRIGGER IF NOT EXISTS trg_orders_stamp_update_phone AFTER UPDATE OF phone ON orders "
+    f"WHEN OLD.phone IS NOT NEW.phone BEGIN {_bump_stamp('OLD')} END",
+    f"CREATE TRIGGER IF NOT EXISTS trg_orders_stamp_delete AFTER DELETE ON orders "
+    f"BEGIN {_bump_stamp('OLD')} END",
+]
+
+
+class BookChange(Base):
+    """
+    Nhật ký thay đổi bảng books (trigger ghi book_id mỗi lần thêm/sửa/xoá). Catalog dạng cột của
+    từng process đọc phần mới từ seq đã biết để vá price/stock tại chỗ thay vì dựng lại.
+    """
+    __tablename__ = "book_changes"
+    # AUTOINCREMENT: seq không bị dùng lại sau khi dọn bớt nhật ký
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    book_id: Mapped[int] = mapped_column(Integer)
+
+
+BOOK_CHANGE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS trg_books_change_insert AFTER INSERT ON books "
+    "BEGIN INSERT INTO book_changes (book_id) VALUES (NEW.id); END",
+    "CREATE TRIGGER IF NOT EXISTS trg_books_change_update AFTER UPDATE ON books "
+    "BEGIN INSERT INTO book_changes (book_id) VALUES (NEW.id); END",
+    "CREATE TRIGGER IF NOT EXISTS trg_books_change_delete AFTER DELETE ON books "
+    "BEGIN INSERT INTO book_changes (book_id) VALUES (OLD.id); END",
+]
+
+
+class ChatSession(Base):
+    """Trạng thái hội thoại theo session id (dùng chung giữa các worker của app.server)."""
+    __tablename__ = "chat_sessions"
+
+    session_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    state: Mapped[str] = mapped_column(Text, default="{}")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self) -> str:
+        return f"ChatSession(session_id={self.session_id!r})"
+
+
+class CustomerBook(Base):
+    """Cạnh khách hàng -> sách trong đồ thị đơn hàng (chỉ tính đơn chưa huỷ)."""
+    __tablename__ = "customer_books"
+
+    customer_key: Mapped[str] = mapped_column(String(80), primary_key=True)
+    book_id: Mapped[int] = mapped_column(ForeignKey("books.id"), primary_key=True)
+    n_orders: Mapped[int] = mapped_column(Integer, default=0)
+
+    def __repr__(self) -> str:
+        return f"CustomerBook(customer_key={self.customer_key!r}, book_id={self.book_id})"
+
+
+class CoPurchase(Base):
+    """Số khách đã mua cả book_a và book_b (lưu cả hai chiều để tra theo book_a)."""
+    __tablename__ = "book_copurchase"
+    __table_args__ = (Index("ix_book_copurchase_a_count", "book_a", "count"),)
+
+    book_a: Mapped[int] = mapped_column(ForeignKey("books.id"), primary_key=True)
+    book_b: Mapped[int] = mapped_column(ForeignKey("books.id"), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+
+    def __repr__(self) -> str:
+        return f"CoPurchase(book_a={self.book_a}, book_b={self.book_b}, count={self.count})"
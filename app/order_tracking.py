@@ -0,0 +1,89 @@
+# app/order_tracking.py
+"""
+Tra cứu "đơn hàng của tôi" theo SĐT.
+- Truy vấn dùng index (phone, created_at) + LIMIT, không quét bảng orders.
+- Cache nhỏ theo SĐT (LRU + TTL) trong process. Trước khi dùng một mục cache, so với
+  order_stamps.version của SĐT (trigger trên orders tăng khi thêm/sửa/xoá đơn, ở bất kỳ process
+  nào) -> worker khác / trang admin đổi đơn thì lần tra sau thấy ngay. Một lần tra PK rẻ hơn
+  nhiều so với truy vấn đầy đủ (join books). invalidate_phone() chỉ xoá cache của process hiện tại.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select
+
+from .db import engine
+from .models import Book, Order, OrderStamp
+
+RECENT_LIMIT = 5
+CACHE_SIZE = 2048
+CACHE_TTL = 30.0
+
+_cache: "OrderedDict[tuple[str, int], tuple[float, int, list[dict]]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def normalize_phone(raw: Optional[str]) -> Optional[str]:
+    """Chỉ giữ chữ số; hợp lệ khi 9–11 số (cùng quy tắc với bước nhập SĐT khi đặt hàng)."""
+    digits = re.sub(r"\D", "", raw or "")
+    return digits if 9 <= len(digits) <= 11 else None
+
+
+def find_phone(text: str) -> Optional[str]:
+    """SĐT đầu tiên trong câu (cho phép dấu cách / chấm / gạch giữa các số)."""
+    for m in re.finditer(r"\d[\d .-]{7,16}\d", text or ""):
+        phone = normalize_phone(m.group(0))
+        if phone:
+            return phone
+    return None
+
+
+def mask_phone(phone: str) -> str:
+    return f"{phone[:3]}****{phone[-3:]}" if len(phone) > 6 else phone
+
+
+def recent_orders(phone: str, limit: int = RECENT_LIMIT) -> list[dict]:
+    """Đơn gần nhất của SĐT (mới trước), kèm tên sách."""
+    key = (phone, limit)
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+    # Connection Core thay cho Session ORM: chỉ đọc, nhẹ hơn đáng kể cho đường cache hit
+    with engine.connect() as conn:
+        # Đọc phiên bản trước khi truy vấn: ghi xen giữa sẽ làm lần sau cache miss, không bị cũ
+        version = conn.scalar(select(OrderStamp.version).where(OrderStamp.phone == phone)) or 0
+        if hit and now - hit[0] < CACHE_TTL and hit[1] == version:
+            with _lock:
+                if key in _cache:
+                    _cache.move_to_end(key)
+            return hit[2]
+        rows = conn.execute(
+            select(Order.id, Order.created_at, Order.status, Order.quantity, Book.title)
+            .join(Book, Book.id == Order.book_id)
+            .where(Order.phone == phone)
+            .order_by(Order.created_at.desc())
+            .limit(limit)
+        ).all()
+    out = [
+        {"id": oid, "created_at": created.strftime("%Y-%m-%d %H:%M"), "status": status, "qty": qty, "title": title}
+        for oid, created, status, qty, title in rows
+    ]
+    with _lock:
+        _cache[key] = (now, version, out)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return out
+
+
+def invalidate_phone(phone: Optional[str] = None) -> None:
+    """Xoá cache của một SĐT (hoặc tất cả nếu phone=None)."""
+    with _lock:
+        if phone is None:
+            _cache.clear()
+            return
+        for key in [k for k in _cache if k[0] == phone]:
+            _cache.pop(key, None)
@@ -0,0 +1,287 @@
+# app/recommender.py
+"""
+Gợi ý sách offline bằng TF-IDF trên n-gram băm (hashing trick), chỉ dùng NumPy.
+
+- Văn bản mỗi sách = title + author + category, đã bỏ dấu (app.textnorm).
+- Đặc trưng: từ đơn, cặp từ liền kề, trigram ký tự của từ trong title (bắt lỗi gõ sai),
+  băm vào N_FEATURES cột; trọng số (1 + log tf) * idf, chuẩn hoá L2.
+- Ma trận lưu dạng inverted index (CSC: cột -> danh sách sách) nên một truy vấn chỉ
+  chạm vào posting của các đặc trưng có trong truy vấn; cosine top-k bằng bincount + argpartition.
+- Dựng một lần cho mỗi phiên bản văn bản của catalog (ColumnarCatalog.text_version); catalog lớn
+  được dựng lại ở thread nền, trong lúc đó truy vấn dùng index cũ (rec.catalog là catalog của nó).
+
+Benchmark: python -m app.recommender
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from itertools import islice
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .catalog import ColumnarCatalog, get_catalog
+from .textnorm import norm_key, norm_keys
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 1 << 20
+# Đặc trưng xuất hiện ở > MAX_DF_RATIO số sách gần như không phân biệt được gì nhưng có
+# posting rất dài -> bỏ khỏi vector truy vấn (vẫn giữ trong chuẩn hoá vector sách).
+MAX_DF_RATIO = 0.2
+_BUILD_CHUNK = 50_000
+# Catalog nhỏ hơn mức này dựng ngay trong lượt gọi (vài ms), lớn hơn thì dựng ở thread nền
+SYNC_BUILD_MAX = 5_000
+
+
+def _features(text: str, title_words: int) -> list[str]:
+    """text đã chuẩn hoá; trigram ký tự chỉ lấy cho `title_words` từ đầu (phần title)."""
+    words = text.split()
+    feats = list(words)
+    feats += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for w in words[:title_words]:
+        if len(w) >= 3:
+            p = f"<{w}>"
+            feats += [p[i:i + 3] for i in range(len(p) - 2)]
+    return feats
+
+
+def _hash_counts(feats: Iterable[str]) -> Counter:
+    mask = N_FEATURES - 1
+    return Counter(hash(f) & mask for f in feats)
+
+
+class TfidfRecommender:
+    def __init__(self, n_docs: int, idf: np.ndarray, indptr: np.ndarray, doc_ids: np.ndarray,
+                 weights: np.ndarray, catalog: ColumnarCatalog):
+        self.n_docs = n_docs
+        self.idf = idf
+        self._indptr = indptr      # CSC: postings của cột j nằm trong [indptr[j], indptr[j+1])
+        self._doc_ids = doc_ids    # vị trí sách (int32)
+        self._weights = weights    # trọng số đã chuẩn hoá (float32)
+        self.catalog = catalog     # catalog mà vị trí trong index trỏ tới
+        self.text_version = catalog.text_version
+        self._min_idf = float(np.log((1.0 + n_docs) / (1.0 + MAX_DF_RATIO * n_docs)) + 1.0)
+
+    @classmethod
+    def from_catalog(cls, catalog: ColumnarCatalog) -> "TfidfRecommender":
+        n = len(catalog)
+        rows_parts, cols_parts, tf_parts = [], [], []
+        texts = catalog.texts()
+        for start in range(0, n, _BUILD_CHUNK):
+            chunk = norm_keys(islice(texts, _BUILD_CHUNK))
+            title_lens = [len(catalog.title(p).split()) for p in range(start, start + len(chunk))]
+            rows, cols, tfs = [], [], []
+            for i, (text, tw) in enumerate(zip(chunk, title_lens)):
+                counts = _hash_counts(_features(text, tw))
+                rows.extend([start + i] * len(counts))
+                cols.extend(counts.keys())
+                tfs.extend(counts.values())
+            rows_parts.append(np.asarray(rows, dtype=np.int32))
+            cols_parts.append(np.asarray(cols, dtype=np.int32))
+            tf_parts.append(np.asarray(tfs, dtype=np.float32))
+
+        rows = np.concatenate(rows_parts) if rows_parts else np.zeros(0, np.int32)
+        cols = np.concatenate(cols_parts) if cols_parts else np.zeros(0, np.int32)
+        tf = np.concatenate(tf_parts) if tf_parts else np.zeros(0, np.float32)
+
+        df = np.bincount(cols, minlength=N_FEATURES)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        w = (1.0 + np.log(tf)) * idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=w * w, minlength=n)).astype(np.float32)
+        w /= np.maximum(norms[rows], 1e-12)
+
+        order = np.argsort(cols, kind="stable")
+        indptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+        return cls(n, idf, indptr, rows[order], w[order].astype(np.float32), catalog)
+
+    @property
+    def nbytes(self) -> int:
+        return self.idf.nbytes + self._indptr.nbytes + self._doc_ids.nbytes + self._weights.nbytes
+
+    # ----- truy vấn -----
+    def _query_vector(self, norm: str, title_words: int) -> tuple[np.ndarray, np.ndarray]:
+        """Vector truy vấn (cột, trọng số chuẩn hoá L2) từ chuỗi đã chuẩn hoá."""
+        counts = _hash_counts(_features(norm, title_words))
+        if not counts:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        idf = self.idf[cols]
+        w = (1.0 + np.log(tf)) * idf
+        w /= max(float(np.linalg.norm(w)), 1e-12)
+        keep = idf >= self._min_idf
+        if keep.any():
+            cols, w = cols[keep], w[keep]
+        return cols, w
+
+    def _scores(self, cols: np.ndarray, qw: np.ndarray) -> np.ndarray:
+        starts, ends = self._indptr[cols], self._indptr[cols + 1]
+        lens = ends - starts
+        if not lens.sum():
+            return np.zeros(self.n_docs, dtype=np.float64)
+        # Gom posting của các cột truy vấn thành một mảng chỉ số, rồi cộng dồn theo sách
+        idx = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+        contrib = self._weights[idx] * np.repeat(qw, lens)
+        return np.bincount(self._doc_ids[idx], weights=contrib, minlength=self.n_docs)
+
+    def _top_k(self, scores: np.ndarray, k: int, mask: Optional[np.ndarray], exclude: Optional[int]) -> list[tuple[int, float]]:
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        if exclude is not None:
+            scores[exclude] = 0.0
+        cand = np.flatnonzero(scores > 1e-9)
+        if len(cand) > k:
+            cand = cand[np.argpartition(-scores[cand], k)[:k]]
+        cand = cand[np.argsort(-scores[cand], kind="stable")]
+        return [(int(p), float(scores[p])) for p in cand]
+
+    def recommend_text(self, text: str, k: int = 5, mask: Optional[np.ndarray] = None) -> list[tuple[int, float]]:
+        """Top-k (vị trí trong catalog, cosine) cho truy vấn tự do."""
+        norm = norm_key(text)
+        cols, qw = self._query_vector(norm, len(norm.split()))
+        if not len(cols):
+            return []
+        return self._top_k(self._scores(cols, qw), k, mask, None)
+
+    def similar_to(self, pos: int, catalog: ColumnarCatalog, k: int = 5,
+                   mask: Optional[np.ndarray] = None) -> list[tuple[int, float]]:
+        """Top-k sách giống sách ở vị trí `pos` (không tính chính nó)."""
+        title = catalog.title(pos)
+        text = norm_key(f"{title} {catalog.authors.names[catalog.author_codes[pos]]} "
+                        f"{catalog.categories.names[catalog.category_codes[pos]]}")
+        cols, qw = self._query_vector(text, len(title.split()))
+        return self._top_k(self._scores(cols, qw), k, mask, pos)
+
+
+# ---------------- cache theo process ----------------
+_recommender: Optional[TfidfRecommender] = None
+_recommender_lock = threading.Lock()   # giữ ngắn: _recommender / _building
+_build_lock = threading.Lock()         # mỗi lúc chỉ một lần dựng index
+_building = False
+
+
+def _build(catalog: ColumnarCatalog) -> TfidfRecommender:
+    global _recommender
+    with _build_lock:
+        rec = _recommender
+        if rec is None or rec.text_version != catalog.text_version:
+            rec = TfidfRecommender.from_catalog(catalog)
+            with _recommender_lock:
+                _recommender = rec
+        return rec
+
+
+def _build_in_background(catalog: ColumnarCatalog) -> None:
+    global _building
+    try:
+        _build(catalog)
+    except Exception:
+        logger.exception("recommender rebuild failed")
+    finally:
+        with _recommender_lock:
+            _building = False
+
+
+def get_recommender(catalog: Optional[ColumnarCatalog] = None, wait: bool = True) -> Optional[TfidfRecommender]:
+    """
+    Recommender của process, dựng lại chỉ khi văn bản catalog đổi (không phải khi stock đổi).
+    wait=False (đường chat): catalog lớn thì không dựng trong lượt gọi mà khởi động dựng nền và trả
+    về index cũ (vị trí theo rec.catalog), hoặc None nếu process chưa có index nào.
+    """
+    global _building
+    catalog = catalog or get_catalog()
+    rec = _recommender
+    if rec is not None and rec.text_version == catalog.text_version:
+        return rec
+    if wait or len(catalog) <= SYNC_BUILD_MAX:
+        return _build(catalog)
+    with _recommender_lock:
+        if not _building:
+            _building = True
+            threading.Thread(target=_build_in_background, args=(catalog,), name="recommender-build",
+                             daemon=True).start()
+        return _recommender
+
+
+def _remap(rec: TfidfRecommender, catalog: ColumnarCatalog) -> tuple[np.ndarray, np.ndarray]:
+    """Vị trí trong `catalog` của từng sách trong index cũ, và mặt nạ sách còn tồn tại."""
+    ids = rec.catalog.ids
+    if not len(catalog):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    pos = np.searchsorted(catalog.ids, ids).clip(max=len(catalog) - 1)
+    return pos, catalog.ids[pos] == ids
+
+
+def recommend(query: str = "", similar_to_id: Optional[int] = None, k: int = 5,
+              in_stock: bool = True, **filters) -> list[dict]:
+    """
+    API gọn cho chat: sách giống `similar_to_id`, hoặc khớp truy vấn tự do.
+    filters: min_price / max_price / category / author (giống ColumnarCatalog.mask).
+    Trả về list[dict] như ColumnarCatalog.row(), kèm "score".
+    """
+    catalog = get_catalog()
+    rec = get_recommender(catalog, wait=False)
+    if rec is None:
+        return []
+    mask = catalog.mask(in_stock=in_stock, **filters)
+    to_new = None
+    if rec.text_version != catalog.text_version:
+        # Index cũ trong lúc dựng nền: lọc/trả kết quả theo catalog hiện tại
+        to_new, alive = _remap(rec, catalog)
+        mask = alive & mask[to_new]
+    if similar_to_id is not None:
+        pos = rec.catalog.position_of(similar_to_id)
+        if pos is None:
+            return []
+        hits = rec.similar_to(pos, rec.catalog, k=k, mask=mask)
+    else:
+        hits = rec.recommend_text(query, k=k, mask=mask)
+    out = []
+    for pos, score in hits:
+        row = catalog.row(int(to_new[pos]) if to_new is not None else pos)
+        row["score"] = round(score, 4)
+        out.append(row)
+    return out
+
+
+# ---------------- benchmark ----------------
+def _bench(n: int = 200_000) -> None:
+    rng = np.random.default_rng(0)
+    syllables = ["tu", "duy", "nhanh", "cham", "nha", "gia", "kim", "mat", "biec", "python", "co", "ban", "tam",
+                 "lich", "su", "the", "gioi", "kinh", "te", "hoc", "lap", "trinh", "ly", "hanh", "phuc", "song"]
+    # ~1000 cụm từ để phân bố đặc trưng gần với tiêu đề thật hơn
+    words = [f"{a} {b}" for a in syllables for b in syllables]
+    words += [f"{a}{b}" for a in syllables for b in syllables[:len(syllables) // 2]]
+    cats = ["Ky nang", "Tieu thuyet", "Khoa hoc", "Van hoc", "CNTT", "Kinh te", "Thieu nhi", "Lich su"]
+
+    def rows():
+        for i in range(n):
+            title = " ".join(words[j] for j in rng.integers(0, len(words), 3)) + f" {i}"
+            yield (i + 1, title, f"Tac gia {rng.integers(0, 20_000)}", 100_000, int(rng.integers(0, 20)),
+                   cats[rng.integers(0, len(cats))])
+
+    catalog = ColumnarCatalog.from_rows(rows())
+    t0 = time.perf_counter()
+    rec = TfidfRecommender.from_catalog(catalog)
+    print(f"build {n:,} books: {time.perf_counter() - t0:.2f}s, index {rec.nbytes / 1e6:.1f} MB")
+
+    mask = catalog.mask(in_stock=True)
+    for label, fn in [
+        ("free text 'sach lap trinh python'", lambda: rec.recommend_text("sach lap trinh python", 5, mask)),
+        ("typo 'tam li hanh fuc'", lambda: rec.recommend_text("tam li hanh fuc", 5, mask)),
+        ("similar_to(pos=42)", lambda: rec.similar_to(42, catalog, 5, mask)),
+    ]:
+        reps = 20
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            hits = fn()
+        ms = (time.perf_counter() - t0) / reps * 1000
+        top = catalog.title(hits[0][0]) if hits else "-"
+        print(f"{label:<36} {ms:6.2f} ms/query  top: {top}")
+
+
+if __name__ == "__main__":
+    _bench()
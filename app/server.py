@@ -0,0 +1,542 @@
+# app/server.py
+"""
+HTTP/JSON chat service cho BookStore (chỉ dùng stdlib asyncio, không cần mạng ngoài).
+
+Chạy:
+    python -m app.server --port 8080 --workers 4
+
+Routes:
+    POST /chat            {"session_id": "<tuỳ chọn>", "message": "..."} -> {"session_id", "reply"}
+    GET  /orders/<id>     trạng thái đơn hàng
+    GET  /orders?phone=…  các đơn gần đây của một SĐT
+    GET  /export/{orders,books}.{csv,jsonl}?status=&since=&until=
+                          export streaming (chunked); cần EXPORT_TOKEN + header
+                          "Authorization: Bearer <token>"
+    GET  /health          liveness
+    GET  /metrics         số request / latency của worker trả lời
+
+Trạng thái hội thoại lưu trong bảng chat_sessions (SQLite) nên mọi worker đều thấy cùng một
+session; session không hoạt động quá SESSION_TTL_HOURS (mặc định 72h) bị worker 0 xoá định kỳ.
+Các lượt chat cùng session được xếp hàng trong một worker; giữa các worker, mỗi lượt claim session
+(compare-and-set updated_at lên mốc now + SESSION_CLAIM_SECONDS) trước khi xử lý, lượt đến sau khi
+session đang bị giữ nhận 409 ngay, chưa chạy gì (vd. chưa tạo đơn) nên gửi lại an toàn.
+Multi-worker: SO_REUSEPORT (mỗi worker bind riêng, kernel chia kết nối) nếu hệ điều
+hành hỗ trợ, ngược lại pre-fork trên một socket chung.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert
+
+from .chat_engine import handle_message, welcome_message, get_order_status
+from .db import engine, get_db_session, init_db
+from .export import export_stream, export_filename, MIME_TYPES
+from .models import ChatSession
+from .order_tracking import normalize_phone, recent_orders
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 64 * 1024
+MAX_HEADER_LINES = 100
+KEEPALIVE_TIMEOUT = 15.0
+EXPORT_QUEUE_CHUNKS = 4
+SESSION_TTL_HOURS = 72.0
+SESSION_SWEEP_INTERVAL = 3600.0
+SESSION_CLAIM_SECONDS = 60.0
+
+
+# ---------------- SESSION STATE ----------------
+class SessionConflict(Exception):
+    """
+    Session đang bị một lượt chat khác (thường ở worker khác) giữ. processed=False: lượt này
+    chưa chạy gì, gửi lại được; processed=True: lượt đã chạy (có thể đã tạo đơn) nhưng không lưu được state.
+    """
+    def __init__(self, session_id: str, processed: bool = False):
+        super().__init__(session_id)
+        self.processed = processed
+
+
+def load_state(session_id: str) -> tuple[Optional[dict], Optional[datetime]]:
+    """(state, updated_at) — updated_at dùng làm phiên bản cho claim_session/save_state."""
+    with get_db_session() as session:
+        row = session.get(ChatSession, session_id)
+        return (json.loads(row.state), row.updated_at) if row else (None, None)
+
+def claim_session(session_id: str, state: dict, expected: Optional[datetime]) -> datetime:
+    """
+    Giữ session trước khi chạy lượt chat: compare-and-set updated_at lên một mốc tương lai
+    (now + SESSION_CLAIM_SECONDS). Lượt khác đọc thấy mốc chưa hết hạn thì claim thất bại
+    -> SessionConflict trước khi có side effect. Trả về mốc đã claim (truyền cho save_state).
+    """
+    now = datetime.utcnow()
+    lease = now + timedelta(seconds=SESSION_CLAIM_SECONDS)
+    with get_db_session() as session:
+        if expected is None:
+            data = json.dumps(state, ensure_ascii=False)
+            stmt = insert(ChatSession).values(session_id=session_id, state=data, updated_at=lease)
+            result = session.execute(stmt.on_conflict_do_nothing(index_elements=[ChatSession.session_id]))
+        else:
+            result = session.execute(
+                update(ChatSession)
+                .where(ChatSession.session_id == session_id, ChatSession.updated_at == expected,
+                       ChatSession.updated_at <= now)
+                .values(updated_at=lease)
+            )
+        if result.rowcount != 1:
+            raise SessionConflict(session_id)
+    return lease
+
+def save_state(session_id: str, state: Optional[dict], claimed: datetime) -> None:
+    """
+    Lưu state và nhả claim (updated_at = now), chỉ khi session vẫn đang được lượt này giữ;
+    state=None: chỉ nhả claim. Claim đã hết hạn và bị lượt khác lấy -> SessionConflict(processed=True).
+    """
+    values = {"updated_at": datetime.utcnow()}
+    if state is not None:
+        values["state"] = json.dumps(state, ensure_ascii=False)
+    with get_db_session() as session:
+        result = session.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == session_id, ChatSession.updated_at == claimed)
+            .values(**values)
+        )
+        if result.rowcount != 1:
+            raise SessionConflict(session_id, processed=True)
+
+def chat_turn(session_id: str, message: str) -> str:
+    """Một lượt chat đồng bộ (chạy trong thread pool): load state -> claim -> xử lý -> lưu state."""
+    state, stamp = load_state(session_id)
+    if state is None:
+        state = {"order_flow": None}
+    claimed = claim_session(session_id, state, stamp)
+    try:
+        reply = welcome_message() if stamp is None and not message.strip() else handle_message(state, message)
+    except Exception:
+        save_state(session_id, None, claimed)
+        raise
+    save_state(session_id, state, claimed)
+    return reply
+
+def sweep_sessions(ttl: Optional[timedelta] = None) -> int:
+    """Xoá session không hoạt động quá `ttl` (mặc định env SESSION_TTL_HOURS, 72h). Trả về số dòng đã xoá."""
+    ttl = ttl or timedelta(hours=float(os.getenv("SESSION_TTL_HOURS", SESSION_TTL_HOURS)))
+    with get_db_session() as session:
+        result = session.execute(delete(ChatSession).where(ChatSession.updated_at < datetime.utcnow() - ttl))
+        return result.rowcount
+
+
+# ---------------- HTTP ----------------
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class StreamBody:
+    """Response dạng luồng: chunks là iterator bytes đồng bộ (đọc DB) chạy trong thread riêng."""
+
+    def __init__(self, chunks, content_type: str, filename: str = ""):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.filename = filename
+
+
+class ChatServer:
+    """Một worker: asyncio server + metrics riêng của process."""
+
+    def __init__(self, worker_id: int = 0):
+        self.worker_id = worker_id
+        self.started_at = time.time()
+        self.metrics = {"requests": 0, "errors": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0, "routes": {}}
+        # Tuần tự hoá các lượt chat của cùng session trong worker này
+        self._session_locks: dict[str, list] = {}  # session_id -> [lock, số người đang dùng]
+
+    # ----- routing -----
+    async def dispatch(self, method: str, path: str, body: bytes, headers: Optional[dict] = None) -> tuple[HTTPStatus, object]:
+        path, _, qs = path.partition("?")
+        path = path.rstrip("/") or "/"
+        if path == "/health":
+            self._allow(method, "GET")
+            return HTTPStatus.OK, {"status": "ok", "pid": os.getpid(), "worker": self.worker_id}
+        if path == "/metrics":
+            self._allow(method, "GET")
+            return HTTPStatus.OK, self.snapshot()
+        if path == "/chat":
+            self._allow(method, "POST")
+            return HTTPStatus.OK, await self.handle_chat(body)
+        if path.startswith("/export/"):
+            self._allow(method, "GET")
+            self._check_export_token(headers or {})
+            kind, _, fmt = path[len("/export/"):].partition(".")
+            params = {k: v[0] for k, v in parse_qs(qs).items()}
+            try:
+                chunks = export_stream(kind, fmt, params.get("status"), params.get("since"), params.get("until"))
+            except ValueError as e:
+                raise HttpError(HTTPStatus.BAD_REQUEST, str(e))
+            return HTTPStatus.OK, StreamBody(chunks, MIME_TYPES[fmt], export_filename(kind, fmt))
+        if path == "/orders":
+            self._allow(method, "GET")
+            phone = normalize_phone((parse_qs(qs).get("phone") or [""])[0])
+            if not phone:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "'phone' must have 9-11 digits")
+            return HTTPStatus.OK, {"orders": await asyncio.to_thread(recent_orders, phone)}
+        if path.startswith("/orders/"):
+            self._allow(method, "GET")
+            oid = path[len("/orders/"):]
+            if not oid.isdigit():
+                raise HttpError(HTTPStatus.BAD_REQUEST, "Order id must be an integer")
+            order = await asyncio.to_thread(get_order_status, int(oid))
+            if order is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, "Order not found")
+            return HTTPStatus.OK, order
+        raise HttpError(HTTPStatus.NOT_FOUND)
+
+    @staticmethod
+    def _check_export_token(headers: dict) -> None:
+        token = os.getenv("EXPORT_TOKEN", "")
+        if not token:
+            raise HttpError(HTTPStatus.FORBIDDEN, "Export is disabled (EXPORT_TOKEN not set)")
+        given = headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            raise HttpError(HTTPStatus.UNAUTHORIZED)
+
+    @staticmethod
+    def _allow(method: str, expected: str) -> None:
+        if method != expected:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+    async def handle_chat(self, body: bytes) -> dict:
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Body must be JSON")
+        if not isinstance(data, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+        message = data.get("message") or ""
+        if not isinstance(message, str):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "'message' must be a string")
+        session_id = str(data.get("session_id") or uuid.uuid4().hex)[:64]
+
+        entry = self._session_locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                reply = await asyncio.to_thread(chat_turn, session_id, message)
+        except SessionConflict as e:
+            if e.processed:
+                raise HttpError(HTTPStatus.CONFLICT, "Message was processed but the session was taken over by "
+                                                     "another request before its state was saved; do not resend")
+            raise HttpError(HTTPStatus.CONFLICT, "Session is busy with another request; nothing was processed, retry")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._session_locks.pop(session_id, None)
+        return {"session_id": session_id, "reply": reply}
+
+    def snapshot(self) -> dict:
+        m = self.metrics
+        n = m["requests"] or 1
+        return {
+            "pid": os.getpid(),
+            "worker": self.worker_id,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "requests": m["requests"],
+            "errors": m["errors"],
+            "latency_ms_avg": round(m["latency_ms_total"] / n, 3),
+            "latency_ms_max": round(m["latency_ms_max"], 3),
+            "routes": dict(m["routes"]),
+        }
+
+    def _record(self, route: str, status: HTTPStatus, started: float) -> None:
+        ms = (time.perf_counter() - started) * 1000
+        m = self.metrics
+        m["requests"] += 1
+        m["latency_ms_total"] += ms
+        m["latency_ms_max"] = max(m["latency_ms_max"], ms)
+        if status >= 500:
+            m["errors"] += 1
+        m["routes"][route] = m["routes"].get(route, 0) + 1
+
+    # ----- connection loop (HTTP/1.1 keep-alive) -----
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                started = time.perf_counter()
+                keep_alive = await self._handle_request(line, reader, writer, started)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _handle_request(self, line, reader, writer, started) -> bool:
+        keep_alive = False
+        chunked = True
+        route = "invalid"
+        try:
+            parts = line.decode("latin-1").split()
+            if len(parts) != 3:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+            method, path, version = parts
+            headers = {}
+            for _ in range(MAX_HEADER_LINES):
+                h = await reader.readline()
+                if h in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = h.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            else:
+                raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+            conn = headers.get("connection", "").lower()
+            keep_alive = conn == "keep-alive" if version == "HTTP/1.0" else conn != "close"
+            chunked = version != "HTTP/1.0"
+
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_BYTES:
+                keep_alive = False
+                raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(length) if length else b""
+
+            route = path.split("?", 1)[0]
+            if route.startswith("/orders/"):
+                route = "/orders/<id>"
+            status, payload = await self.dispatch(method, path, body, headers)
+        except HttpError as e:
+            status, payload = e.status, {"error": str(e)}
+        except ValueError:
+            status, payload, keep_alive = HTTPStatus.BAD_REQUEST, {"error": "Bad request"}, False
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception:
+            logger.exception("Unhandled error")
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+
+        if isinstance(payload, StreamBody):
+            keep_alive = await self._write_stream(writer, status, payload, keep_alive, chunked)
+            self._record(route, status, started)
+            return keep_alive
+
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head + data)
+        await writer.drain()
+        self._record(route, status, started)
+        return keep_alive
+
+    async def _write_stream(self, writer: asyncio.StreamWriter, status: HTTPStatus,
+                            body: StreamBody, keep_alive: bool, chunked: bool = True) -> bool:
+        """
+        Transfer-Encoding: chunked. Generator đọc DB chạy trọn trong một thread (giữ nguyên
+        connection SQLite), đẩy khối qua hàng đợi có giới hạn -> bộ nhớ không đổi, có backpressure.
+        Client HTTP/1.0 không hiểu chunked: gửi body thô rồi đóng kết nối để đánh dấu kết thúc.
+        """
+        if not chunked:
+            keep_alive = False
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {body.content_type}; charset=utf-8\r\n"
+            + (f'Content-Disposition: attachment; filename="{body.filename}"\r\n' if body.filename else "")
+            + ("Transfer-Encoding: chunked\r\n" if chunked else "")
+            + f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        ).encode("latin-1")
+        writer.write(head)
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+        cancelled = False
+        done = object()
+
+        def produce():
+            try:
+                for block in body.chunks:
+                    if cancelled:
+                        break
+                    asyncio.run_coroutine_threadsafe(queue.put(block), loop).result()
+            except BaseException as e:  # chuyển lỗi sang phía async
+                asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+                return
+            finally:
+                body.chunks.close()
+            asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+        producer = loop.run_in_executor(None, produce)
+        failed = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    # Header đã gửi -> chỉ có thể cắt kết nối để client biết file không trọn vẹn
+                    logger.error("export failed: %s", item)
+                    keep_alive, failed = False, True
+                    break
+                if item:
+                    writer.write(b"%x\r\n%s\r\n" % (len(item), item) if chunked else item)
+                    await writer.drain()
+            if chunked and not failed:
+                # Luôn gửi chunk kết thúc khi thành công, kể cả khi sắp đóng kết nối
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        except BaseException:
+            cancelled = True
+            # Giải phóng producer đang chờ put()
+            while not producer.done():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    await asyncio.sleep(0.01)
+            raise
+        finally:
+            await producer
+        return keep_alive
+
+    async def serve(self, host: str, port: int, sock: Optional[socket.socket] = None, reuse_port: bool = False) -> None:
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection, host, port, reuse_port=reuse_port, backlog=1024
+            )
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda: stop.done() or stop.set_result(None))
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows
+        # Một worker dọn chat_sessions định kỳ là đủ (bảng dùng chung)
+        sweeper = asyncio.create_task(self._sweep_loop()) if self.worker_id == 0 else None
+        async with server:
+            logger.info("worker %s (pid %s) listening on %s:%s", self.worker_id, os.getpid(), host, port)
+            await stop
+        if sweeper:
+            sweeper.cancel()
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                n = await asyncio.to_thread(sweep_sessions)
+                if n:
+                    logger.info("swept %d idle chat sessions", n)
+            except Exception:
+                logger.exception("session sweep failed")
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+
+
+# ---------------- PROCESS MODEL ----------------
+def _run_worker(worker_id: int, host: str, port: int, sock=None, reuse_port: bool = False) -> None:
+    try:
+        asyncio.run(ChatServer(worker_id).serve(host, port, sock=sock, reuse_port=reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+def run(host: str = "127.0.0.1", port: int = 8080, workers: int = 1, reuse_port: Optional[bool] = None) -> None:
+    """Chạy server; workers > 1 thì fork (POSIX) — SO_REUSEPORT nếu có, ngược lại pre-fork socket chung."""
+    if workers <= 1 or not hasattr(os, "fork"):
+        _run_worker(0, host, port)
+        return
+
+    if reuse_port is None:
+        reuse_port = hasattr(socket, "SO_REUSEPORT")
+    sock = None
+    if not reuse_port:
+        sock = socket.create_server((host, port), backlog=1024)
+        sock.setblocking(False)
+
+    # Không chia sẻ connection pool SQLite qua fork
+    engine.dispose()
+    children = []
+    for i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                engine.dispose(close=False)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                _run_worker(i, host, port, sock=sock, reuse_port=reuse_port)
+            except BaseException:
+                logger.exception("worker %s crashed", i)
+                code = 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+
+    mode = "SO_REUSEPORT" if reuse_port else "pre-fork"
+    logger.info("started %d workers (%s) on %s:%s", workers, mode, host, port)
+
+    def _stop(*_):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        _stop()
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+def main(argv=None) -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="BookStore HTTP/JSON chat service")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "1")))
+    parser.add_argument("--no-reuseport", action="store_true", help="dùng pre-fork trên socket chung thay vì SO_REUSEPORT")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+
+    init_db()
+    if os.getenv("DEMO_MODE", "1").lower() in ("1", "true", "yes", "y"):
+        try:
+            from .seed import seed
+            seed()
+        except Exception:
+            logger.exception("seed failed")
+
+    run(args.host, args.port, args.workers, reuse_port=False if args.no_reuseport else None)
+
+
+if __name__ == "__main__":
+    main()
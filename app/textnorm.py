@@ -0,0 +1,172 @@
+# app/textnorm.py
+"""
+Chuẩn hoá chuỗi tiếng Việt (bỏ dấu, gộp đ -> d) dùng cho so khớp không phân biệt dấu.
+- Bảng str.translate dựng sẵn một lần, không gọi unicodedata cho chuỗi tiếng Việt thông thường.
+- norm_key() có LRU cache vì title/author/category bị chuẩn hoá lặp lại mỗi lượt chat.
+- norm_keys() chuẩn hoá cả một cột trong một lần NFD + encode ASCII (nhanh ~2x so với gọi
+  norm_key từng phần tử khi cột không lặp lại).
+
+Benchmark + kiểm tra độ phủ: python -m app.textnorm
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+# Toàn bộ chữ có dấu của tiếng Việt (chữ thường), nhóm theo chữ gốc.
+VIETNAMESE_CHARS = {
+    "a": "àáảãạăằắẳẵặâầấẩẫậ",
+    "e": "èéẻẽẹêềếểễệ",
+    "i": "ìíỉĩị",
+    "o": "òóỏõọôồốổỗộơờớởỡợ",
+    "u": "ùúủũụưừứửữự",
+    "y": "ỳýỷỹỵ",
+    "d": "đ",
+}
+
+# Dấu kết hợp (khi input ở dạng NFD): huyền, sắc, hỏi, ngã, nặng, mũ, trăng, móc.
+_COMBINING_MARKS = "̛̣̀́̉̃̂̆"
+
+# Ký tự phân cách khi chuẩn hoá theo lô (Unit Separator, gần như không xuất hiện trong dữ liệu).
+_BATCH_SEP = "\x1f"
+
+# Sau NFD: ký tự không phải ASCII và không phải dấu kết hợp (U+0300–U+036F, đều thuộc loại Mn).
+_NON_LATIN_RE = re.compile("[^\x00-\x7f\u0300-\u036f]")
+
+
+def _build_table() -> dict:
+    table = {}
+    for base, chars in VIETNAMESE_CHARS.items():
+        for ch in chars:
+            table[ord(ch)] = base
+            table[ord(ch.upper())] = base.upper()
+    for mark in _COMBINING_MARKS:
+        table[ord(mark)] = None
+    return table
+
+
+_FOLD_TABLE = _build_table()
+
+
+def _strip_accents_slow(s: str) -> str:
+    """Đường chậm cho ký tự ngoài bảng (VD: ç, ñ): NFD + bỏ ký tự loại Mn."""
+    s = unicodedata.normalize("NFD", s)
+    return "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+
+
+def strip_accents(s: Optional[str]) -> str:
+    """Bỏ dấu, giữ nguyên hoa/thường. 'Đắc Nhân Tâm' -> 'Dac Nhan Tam'."""
+    out = (s or "").translate(_FOLD_TABLE)
+    if out.isascii():
+        return out
+    return _strip_accents_slow(out)
+
+
+@lru_cache(maxsize=65536)
+def norm_key(s: Optional[str]) -> str:
+    """Khoá so khớp: bỏ dấu + strip + lower. Có cache cho chuỗi catalog lặp lại."""
+    return strip_accents(s).strip().lower()
+
+
+def norm_keys(values: Iterable[Optional[str]]) -> List[str]:
+    """
+    Chuẩn hoá cả cột (list title/author/category...), kết quả giống [norm_key(v) for v in values].
+    Không dùng str.translate cho chuỗi ghép: gặp ký tự có dấu đầu tiên là translate rời đường
+    nhanh ASCII cho phần còn lại; NFD + encode("ascii", "ignore") chạy hoàn toàn trong C.
+    """
+    items = [v or "" for v in values]
+    if not items:
+        return []
+    joined = _BATCH_SEP.join(items)
+    if joined.count(_BATCH_SEP) != len(items) - 1:
+        # Dữ liệu có sẵn ký tự phân cách -> xử lý từng phần tử
+        return [norm_key(v) for v in items]
+    decomposed = unicodedata.normalize("NFD", joined.replace("đ", "d").replace("Đ", "D"))
+    if _NON_LATIN_RE.search(decomposed):
+        # Có ký tự ngoài Latin (CJK, emoji, ø...) mà encode ASCII sẽ làm mất -> đường chính xác
+        return [norm_key(v) for v in items]
+    folded = decomposed.encode("ascii", "ignore").decode("ascii").lower()
+    return [part.strip() for part in folded.split(_BATCH_SEP)]
+
+
+# ---------------- Kiểm tra & benchmark ----------------
+def _legacy_norm_key(s: str) -> str:
+    """Cài đặt cũ trong streamlit_app.py (để so sánh)."""
+    s = unicodedata.normalize("NFD", s or "")
+    return "".join(ch for ch in s if unicodedata.category(ch) != "Mn").strip().lower()
+
+
+def _check(cond: bool, detail) -> None:
+    # Không dùng assert: python -O sẽ bỏ qua
+    if not cond:
+        raise AssertionError(detail)
+
+
+def _self_check() -> None:
+    """Đảm bảo bảng bao phủ mọi nguyên âm x thanh điệu tiếng Việt (cả hoa/thường) và đ/Đ."""
+    vowels = "aăâeêioôơuưy"
+    tones = ["", "\u0300", "\u0301", "\u0309", "\u0303", "\u0323"]
+    expected = set()
+    for v in vowels:
+        for t in tones:
+            ch = unicodedata.normalize("NFC", v + t)
+            if not ch.isascii():
+                expected.add(ch)
+    expected.add("đ")
+    expected |= {ch.upper() for ch in expected}
+
+    missing = sorted(ch for ch in expected if ord(ch) not in _FOLD_TABLE)
+    _check(not missing, f"Thiếu trong bảng: {''.join(missing)}")
+    for ch in expected:
+        folded = strip_accents(ch)
+        ref = "D" if ch == "Đ" else "d" if ch == "đ" else _strip_accents_slow(ch)
+        _check(folded == ref and folded.isascii(), (ch, folded, ref))
+        # Input dạng NFD cũng phải cho cùng kết quả
+        _check(strip_accents(unicodedata.normalize("NFD", ch)) == ref, ch)
+
+    _check(norm_key("  Đắc Nhân Tâm ") == "dac nhan tam", "norm_key")
+    _check(strip_accents("Façade Niño") == "Facade Nino", "strip_accents")
+    # norm_keys phải khớp norm_key ở cả đường nhanh và đường dự phòng
+    for batch in (["Đắc Nhân Tâm", None, " Kỹ năng ", "Façade"], ["Øresund", "東京 Đà Lạt", "a\x1fb"]):
+        _check(norm_keys(batch) == [norm_key(v) for v in batch], batch)
+    _check(norm_keys(sorted(expected)) == [norm_key(ch) for ch in sorted(expected)], "norm_keys")
+
+
+def _bench(rounds: int = 20000) -> None:
+    import timeit
+
+    samples = [
+        "Đắc Nhân Tâm", "Nhà Giả Kim", "Tư duy nhanh và chậm", "Sách Mắt Biếc",
+        "Python Cơ Bản", "Dale Carnegie", "Nguyễn Nhật Ánh", "Kỹ năng", "Tiểu thuyết",
+    ]
+
+    def run_legacy():
+        for s in samples:
+            _legacy_norm_key(s)
+
+    def run_uncached():
+        for s in samples:
+            norm_key.__wrapped__(s)
+
+    def run_cached():
+        for s in samples:
+            norm_key(s)
+
+    def run_batch():
+        norm_keys(samples)
+
+    n = len(samples) * rounds
+    for label, fn in [
+        ("legacy (NFD + category)", run_legacy),
+        ("translate (no cache)", run_uncached),
+        ("norm_key (lru_cache)", run_cached),
+        ("norm_keys (batch)", run_batch),
+    ]:
+        secs = timeit.timeit(fn, number=rounds)
+        print(f"{label:<26} {secs / n * 1e9:8.0f} ns/chuỗi")
+
+
+if __name__ == "__main__":
+    _self_check()
+    print("Self-check OK: bảng bao phủ toàn bộ ký tự tiếng Việt (kể cả đ/Đ).")
+    _bench()